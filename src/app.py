@@ -138,6 +138,9 @@ class App(Adw.Application):
 
         gl.signal_manager.trigger_signal(Signals.AppQuit)
 
+        # Write settings that are still waiting for their delayed save
+        gl.settings_manager.flush()
+
         gl.threads_running = False
 
         # Force quit if normal quit is not possible
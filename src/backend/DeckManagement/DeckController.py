@@ -13,17 +13,21 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 # Import Python modules
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from copy import copy
 from functools import lru_cache
+import itertools
 import os
 from queue import Queue
 import random
 import statistics
+import zlib
 from threading import Thread, Timer
 import threading
 import time
 from PIL import Image, ImageOps, ImageDraw, ImageFont, ImageSequence
+import cv2
 from StreamDeck.DeviceManager import DeviceManager
 from StreamDeck.ImageHelpers import PILHelper
 from StreamDeck.Devices import StreamDeck
@@ -38,6 +42,13 @@ from src.backend.DeckManagement.Subclasses.KeyImage import KeyImage
 from src.backend.DeckManagement.Subclasses.KeyVideo import KeyVideo
 from src.backend.DeckManagement.Subclasses.KeyLabel import KeyLabel
 from src.backend.DeckManagement.Subclasses.KeyLayout import KeyLayout
+from src.backend.DeckManagement.Subclasses.composite_cache import CompositeCache
+from src.backend.DeckManagement.Subclasses.key_tiler import KeyTiler
+from src.backend.DeckManagement.Subclasses.native_encoder import NativeKeyEncoder
+from src.backend.DeckManagement.Subclasses.font_registry import font_registry
+from src.backend.DeckManagement.Subclasses.frame_prefetcher import FramePrefetcher
+from src.backend.DeckManagement.Subclasses.frame_clock import FrameClock, NS_PER_SECOND
+from src.backend.DeckManagement.Subclasses.label_layer_cache import label_layer_cache
 from dataclasses import dataclass
 import gc
 
@@ -89,15 +100,21 @@ class MediaPlayerSetImageTask:
 
     n_failed_in_row: ClassVar[dict] = {}
 
-    def run(self):
+    def run(self) -> bool:
+        """
+        Returns True if the image got written to the deck
+        """
         try:
             self.deck_controller.deck.set_key_image(self.key_index, self.native_image)
             self.native_image = None
             del self.native_image
             MediaPlayerSetImageTask.n_failed_in_row[self.deck_controller.serial_number()] = 0
+            return True
         except StreamDeck.TransportError as e:
             log.error(f"Failed to set deck key image. Error: {e}")
-            return
+            # The key doesn't show this image, so the next one must not be suppressed
+            self.deck_controller.invalidate_native_image_hash(self.key_index)
+            return False
             MediaPlayerSetImageTask.n_failed_in_row[self.deck_controller.serial_number()] += 1
             if MediaPlayerSetImageTask.n_failed_in_row[self.deck_controller.serial_number()] > 5:
                 log.debug(f"Failed to set key_image for 5 times in a row for deck {self.deck_controller.serial_number()}. Removing controller")
@@ -110,6 +127,118 @@ class MediaPlayerSetImageTask:
                 gl.deck_manager.connect_new_decks()
 
 
+class DeckWriterThread(threading.Thread):
+    """
+    Writes the native key images to the deck, so that slow USB transfers don't stall the rendering of other keys.
+    Every key has one slot that only holds its latest image - images that got replaced before being written are dropped.
+    """
+    def __init__(self, deck_controller: "DeckController", tick_interval: float = 1/30):
+        super().__init__(name="DeckWriterThread", daemon=True)
+        self.deck_controller: DeckController = deck_controller
+        self.tick_interval = tick_interval
+
+        # Maximum number of images written per tick, 0 means no limit
+        self.write_budget: int = gl.settings_manager.get_app_settings().get("performance", {}).get("usb-writes-per-tick", 0)
+
+        self.condition = threading.Condition()
+        # key index -> latest image task, ordered by the time the key got its first pending image
+        self.slots: OrderedDict[int, MediaPlayerSetImageTask] = OrderedDict()
+
+        self._stop = False
+
+        # Stats
+        self.n_written: int = 0
+        self.n_failed: int = 0
+        self.n_superseded: int = 0
+        self.max_backlog: int = 0
+        self.write_time: float = 0
+        self.last_report: float = time.time()
+
+    def submit(self, task: "MediaPlayerSetImageTask") -> None:
+        with self.condition:
+            if task.key_index in self.slots:
+                self.n_superseded += 1
+            # Replacing keeps the position of the key, so a key that changes on every tick can't starve others
+            self.slots[task.key_index] = task
+            self.max_backlog = max(self.max_backlog, len(self.slots))
+            self.condition.notify()
+
+    def clear(self) -> None:
+        with self.condition:
+            self.slots.clear()
+
+    def get_backlog(self) -> int:
+        return len(self.slots)
+
+    def is_backlogged(self) -> bool:
+        """
+        Returns True if every key is waiting for a write
+        """
+        return len(self.slots) >= len(self.deck_controller.keys)
+
+    def get_stats(self) -> dict:
+        return {
+            "written": self.n_written,
+            "failed": self.n_failed,
+            "superseded": self.n_superseded,
+            "backlog": self.get_backlog(),
+            "max-backlog": self.max_backlog,
+            "average-write-ms": self.write_time / self.n_written * 1000 if self.n_written else 0,
+        }
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.slots and not self._stop:
+                    self.condition.wait()
+                if self._stop:
+                    break
+
+                tick_start = time.time()
+                n_writes = len(self.slots)
+                if self.write_budget > 0:
+                    n_writes = min(n_writes, self.write_budget)
+                batch = [self.slots.popitem(last=False)[1] for _ in range(n_writes)]
+
+            for task in batch:
+                start = time.time()
+                try:
+                    written = task.run()
+                except Exception as e:
+                    log.error(f"Failed to write the image of key {task.key_index} to deck {self.deck_controller.serial_number()}: {e}")
+                    self.deck_controller.invalidate_native_image_hash(task.key_index)
+                    written = False
+                # Only successful writes count towards the write time
+                if written:
+                    self.write_time += time.time() - start
+                    self.n_written += 1
+                else:
+                    self.n_failed += 1
+
+            self.report_stats()
+
+            if self.write_budget > 0:
+                # Leave the remaining writes to the next tick
+                time.sleep(max(0, self.tick_interval - (time.time() - tick_start)))
+
+    def report_stats(self) -> None:
+        if time.time() - self.last_report < 1:
+            return
+        self.last_report = time.time()
+        if self.n_superseded > 0 or self.max_backlog > 1 or self.n_failed > 0:
+            stats = self.get_stats()
+            log.trace(f"USB writer of deck {self.deck_controller.serial_number()}: {stats['written']} written, {stats['failed']} failed, {stats['superseded']} superseded, "
+                      f"max backlog {stats['max-backlog']}, {stats['average-write-ms']:.2f} ms per write")
+
+    def stop(self) -> None:
+        with self.condition:
+            self._stop = True
+            self.slots.clear()
+            self.condition.notify_all()
+        if threading.current_thread() is not self:
+            self.join(timeout=2)
+
+
 class MediaPlayerThread(threading.Thread):
     def __init__(self, deck_controller: "DeckController"):
         super().__init__(name="MediaPlayerThread", daemon=True)
@@ -123,64 +252,185 @@ class MediaPlayerThread(threading.Thread):
         self._stop = False
 
         self.tasks: list[MediaPlayerTask] = []
-        self.image_tasks = {}
 
         self.fps: list[float] = []
         self.old_warning_state = False
 
+        # Keys that changed since the last tick and need to be rendered again
+        self.dirty_keys: set[int] = set()
+        self.dirty_keys_lock = threading.Lock()
+
+        # (rendered, skipped) keys of the last tick and the sums since the last report
+        self.last_render_stats: tuple[int, int] = (0, 0)
+        self.rendered_since_report: int = 0
+        self.skipped_since_report: int = 0
+        self.suppressed_writes_at_report: int = 0
+        self.saved_bytes_at_report: int = 0
+        self.last_report_ns: int = time.monotonic_ns()
+
+        # The thread sleeps on this condition while nothing animates and no work is pending
+        self.wakeup = threading.Condition()
+        self.wakeup_pending = False
+        self.wakeups_since_report: int = 0
+        self.wakeups_per_second: float = 0
+
         self.show_fps_warnings = gl.settings_manager.get_app_settings().get("warnings", {}).get("enable-fps-warnings", True)
 
     # @log.catch
     def run(self):
         self.running = True
 
-        
-
-
         while True:
-            start = time.time()
+            start = time.monotonic_ns()
+            # The next tick is due after 1/FPS at the latest, so that tasks and key updates don't wait longer
+            deadlines: list[int] = [start + NS_PER_SECOND // self.FPS]
 
             # self.check_connection()
 
+            self.wakeups_since_report += 1
+
             if not self.pause:
-                if self.deck_controller.background.video is not None:
-                    if self.deck_controller.background.video.page is self.deck_controller.active_page:
-                        # There is a background video
-                        video_each_nth_frame = self.FPS // self.deck_controller.background.video.fps
-                        if self.media_ticks % video_each_nth_frame == 0:
-                            self.deck_controller.background.update_tiles()
+                # Every key still waits for its last image, so new video frames would only replace them - drop them instead
+                writer_behind = self.deck_controller.deck_writer.is_backlogged()
+
+                video = self.deck_controller.background.video
+                if video is not None and video.page is self.deck_controller.active_page:
+                    # There is a background video
+                    if video.is_frame_due(start) and not writer_behind:
+                        self.deck_controller.background.update_tiles()
+                        self.mark_keys_with_visible_background_dirty()
+                    if video.get_next_deadline() is not None:
+                        deadlines.append(video.get_next_deadline())
 
                 for key in self.deck_controller.keys:
                     # break
                     active_state = key.get_active_state()
-                    if active_state is not None:
-                        if active_state.key_video is not None:
-                            video_each_nth_frame = self.FPS // active_state.key_video.fps
-                            if self.media_ticks % video_each_nth_frame == 0:
-                                key.update()
-                    elif self.deck_controller.background.video is not None:
-                        key.update()
+                    if active_state is None or active_state.key_video is None:
+                        continue
+                    key_video = active_state.key_video
+                    if key_video.is_frame_due(start) and not writer_behind:
+                        self.mark_key_dirty(key.key)
+                    if key_video.get_next_deadline() is not None:
+                        deadlines.append(key_video.get_next_deadline())
+
+                # Only render the keys that actually changed
+                self.render_dirty_keys()
 
                 # self.deck_controller.update_all_keys()
 
                 # Perform media player tasks
                 self.perform_media_player_tasks()
 
+            with self.wakeup:
+                # Everything that arrived until now got handled or is seen by has_pending_work
+                self.wakeup_pending = False
+
             self.media_ticks += 1
 
-            # Wait for approximately 1/30th of a second before the next call
-            end = time.time()
-            # print(f"possible FPS: {1 / (end - start)}")
-            self.append_fps(1 / (end - start))
+            # Sleep until the earliest frame deadline instead of a fixed 1/FPS, so videos keep their own timing
+            end = time.monotonic_ns()
+            self.append_fps(NS_PER_SECOND / max(1, end - start))
             self.update_low_fps_warning()
-            wait = max(0, 1/self.FPS - (end - start))
-            time.sleep(wait)
+            wait = max(0, min(deadlines) - end)
+
+            # Nothing animates and no work is pending, so sleep until new work arrives
+            idle = self.pause or (len(deadlines) == 1 and not self.has_pending_work())
+            with self.wakeup:
+                if not self.wakeup_pending and not self._stop:
+                    self.wakeup.wait(None if idle else wait / NS_PER_SECOND)
 
             if self._stop:
                 break
 
         self.running = False
 
+    def mark_key_dirty(self, key_index: int) -> None:
+        with self.dirty_keys_lock:
+            self.dirty_keys.add(key_index)
+        self.wake_up()
+
+    def wake_up(self) -> None:
+        """
+        Starts the next tick right away, even if the thread is idle
+        """
+        with self.wakeup:
+            self.wakeup_pending = True
+            self.wakeup.notify()
+
+    def has_pending_work(self) -> bool:
+        return len(self.tasks) > 0 or len(self.dirty_keys) > 0
+
+    def mark_keys_with_visible_background_dirty(self) -> None:
+        """
+        Marks all keys as dirty that show at least a part of the background tile.
+        Keys with an opaque background color hide the tile, so a new tile doesn't change them.
+        """
+        for key in self.deck_controller.keys:
+            if key.get_active_state().background_color[-1] < 255:
+                self.mark_key_dirty(key.key)
+
+    def is_animating(self) -> bool:
+        """
+        Returns True if this thread re-renders keys on every tick because a background video is playing.
+        In this case key updates can be deferred to the next tick.
+        """
+        if not self.running or self.pause or self._stop:
+            return False
+        video = self.deck_controller.background.video
+        if video is None:
+            return False
+        return video.page is self.deck_controller.active_page
+
+    def render_dirty_keys(self) -> None:
+        with self.dirty_keys_lock:
+            dirty_keys = self.dirty_keys
+            self.dirty_keys = set()
+
+        n_keys = len(self.deck_controller.keys)
+        rendered = 0
+        for key_index in sorted(dirty_keys):
+            if key_index >= n_keys:
+                continue
+            self.deck_controller.render_key(key_index)
+            rendered += 1
+
+        self.last_render_stats = (rendered, n_keys - rendered)
+        self.rendered_since_report += rendered
+        self.skipped_since_report += n_keys - rendered
+
+        # Report about once a second
+        now = time.monotonic_ns()
+        if now - self.last_report_ns >= NS_PER_SECOND:
+            last_report_ns = self.last_report_ns
+            self.last_report_ns = now
+            if self.rendered_since_report > 0:
+                log.trace(f"Rendered {self.rendered_since_report} keys, skipped {self.skipped_since_report} unchanged keys in the last second on deck {self.deck_controller.serial_number()}")
+            self.rendered_since_report = 0
+            self.skipped_since_report = 0
+
+            suppressed_writes, saved_bytes = self.deck_controller.get_suppressed_write_stats()
+            if suppressed_writes > self.suppressed_writes_at_report:
+                log.trace(f"Skipped {suppressed_writes - self.suppressed_writes_at_report} identical key images ({(saved_bytes - self.saved_bytes_at_report) / 1024:.1f} KiB) in the last second on deck {self.deck_controller.serial_number()}")
+            self.suppressed_writes_at_report = suppressed_writes
+            self.saved_bytes_at_report = saved_bytes
+
+            # The last report can be longer ago than a second if the thread was idle
+            self.wakeups_per_second = self.wakeups_since_report * NS_PER_SECOND / (now - last_report_ns)
+            self.wakeups_since_report = 0
+            log.trace(f"Media player of deck {self.deck_controller.serial_number()} woke up {self.wakeups_per_second:.1f} times per second")
+
+    def get_render_stats(self) -> tuple[int, int]:
+        """
+        Returns the number of rendered and skipped keys of the last tick
+        """
+        return self.last_render_stats
+
+    def get_wakeups_per_second(self) -> float:
+        """
+        Returns the number of ticks per second since the previous report, 0 while nothing changes on the deck
+        """
+        return self.wakeups_per_second
+
     def append_fps(self, fps: float) -> None:
         self.fps.append(fps)
         if len(self.fps) > self.FPS *2:
@@ -219,6 +469,7 @@ class MediaPlayerThread(threading.Thread):
 
     def stop(self) -> None:
         self._stop = True
+        self.wake_up()
         while self.running:
             time.sleep(0.1)
 
@@ -230,14 +481,20 @@ class MediaPlayerThread(threading.Thread):
             args=args,
             kwargs=kwargs
         ))
+        self.wake_up()
 
     def add_image_task(self, key_index: int, native_image: bytes):
-        self.image_tasks[key_index] = MediaPlayerSetImageTask(
-            deck_controller=self.deck_controller,
-            page=self.deck_controller.active_page,
-            key_index=key_index,
-            native_image=native_image
-        )
+        # Keys can be rendered from several threads, the recorded hash has to belong to the image that ends up in the slot
+        with self.deck_controller.native_image_hashes_lock:
+            if not self.deck_controller.is_native_image_changed(key_index, native_image):
+                return
+            # The write itself happens on the writer thread of the deck
+            self.deck_controller.deck_writer.submit(MediaPlayerSetImageTask(
+                deck_controller=self.deck_controller,
+                page=self.deck_controller.active_page,
+                key_index=key_index,
+                native_image=native_image
+            ))
 
     def perform_media_player_tasks(self):
         for task in self.tasks.copy():
@@ -249,13 +506,6 @@ class MediaPlayerThread(threading.Thread):
             except ValueError:
                 pass
 
-        for key in list(self.image_tasks.keys()):
-            try:
-                self.image_tasks[key].run()
-                del self.image_tasks[key]
-            except KeyError:
-                pass
-
     def check_connection(self):
         try:
             self.deck_controller.deck.get_firmware_version()
@@ -278,6 +528,14 @@ class DeckController:
         # Open the deck
         deck.open()
         print()
+
+        self.native_encoder = NativeKeyEncoder(deck)
+
+        # Hash of the last native image sent to each key - identical images don't have to be written again
+        self.native_image_hashes: dict[int, tuple[int, int]] = {}
+        self.native_image_hashes_lock = threading.RLock()
+        self.n_suppressed_writes: int = 0
+        self.n_suppressed_bytes: int = 0
         
         try:
             # Clear the deck
@@ -312,14 +570,24 @@ class DeckController:
 
         self.background = Background(self)
 
+        # Cache of the final key images - repeated renders of unchanged keys only cost a lookup
+        n_cached_images = gl.settings_manager.get_app_settings().get("performance", {}).get("n-cached-key-images", 256)
+        self.composite_cache = CompositeCache(max_entries=n_cached_images)
+
         self.deck.set_key_callback(self.key_change_callback)
 
+        # Start the thread that writes the key images to the deck
+        self.deck_writer = DeckWriterThread(deck_controller=self)
+        self.deck_writer.start()
+
         # Start media player thread
         self.media_player = MediaPlayerThread(deck_controller=self)
         self.media_player.start()
 
         self.keep_actions_ticking = True
         self.TICK_DELAY = 1
+        # Set when the actions or the screen saver change, wakes up the tick thread if it is idle
+        self.tick_event = threading.Event()
         self.tick_thread = Thread(target=self.tick_actions, name="tick_actions")
         self.tick_thread.start()
 
@@ -342,24 +610,104 @@ class DeckController:
         return self.deck.is_visual()
 
     def update_key(self, index: int):
-        image = self.keys[index].get_current_deck_image()
-        
-        rgb_image = image.convert("RGB")
+        if self.media_player.is_animating():
+            # The media player renders all changed keys on its next tick anyway
+            self.media_player.mark_key_dirty(index)
+            return
+        self.render_key(index)
+
+    def render_key(self, index: int):
+        key = self.keys[index]
+
+        if self.background.video is not None and key.shows_only_background_tile():
+            self.render_background_video_tile(index)
+            return
+
+        fingerprint = key.get_image_fingerprint()
+        cached = None
+        if fingerprint is not None:
+            cached = self.composite_cache.get(fingerprint)
+
+        if cached is not None:
+            image = cached.image
+            native_image = cached.native_image
+        else:
+            image = key.get_current_deck_image()
+            native_image = None
+
+            if self.is_visual():
+                native_image = self.native_encoder.encode(image)
+
+            if fingerprint is not None:
+                self.composite_cache.put(fingerprint, image, native_image)
+
+        if native_image is not None:
+            self.media_player.add_image_task(index, native_image)
+
+        key.set_ui_key_image(image)
+
+    def is_native_image_changed(self, index: int, native_image: bytes) -> bool:
+        """
+        Returns False if the native image is identical to the last one sent to the key, the write can be skipped then.
+        Otherwise the image is remembered as the new content of the key.
+        """
+        image_hash = (len(native_image), zlib.crc32(native_image))
+        with self.native_image_hashes_lock:
+            if self.native_image_hashes.get(index) == image_hash:
+                self.n_suppressed_writes += 1
+                self.n_suppressed_bytes += len(native_image)
+                return False
+            self.native_image_hashes[index] = image_hash
+        return True
+
+    def invalidate_native_image_hash(self, index: int) -> None:
+        with self.native_image_hashes_lock:
+            self.native_image_hashes.pop(index, None)
+
+    def invalidate_native_image_hashes(self) -> None:
+        """
+        Forgets the content of all keys, used whenever the deck got written without is_native_image_changed
+        """
+        with self.native_image_hashes_lock:
+            self.native_image_hashes.clear()
+
+    def get_suppressed_write_stats(self) -> tuple[int, int]:
+        """
+        Returns the number of skipped writes and the number of bytes they would have sent
+        """
+        return self.n_suppressed_writes, self.n_suppressed_bytes
+
+    def render_background_video_tile(self, index: int):
+        """
+        Renders a key that shows nothing but its tile of the background video.
+        The native image of each tile is encoded once per frame, so looping videos only need to be encoded in the first loop.
+        """
+        video = self.background.video
+        tile = self.background.tiles[index]
+        if tile is None:
+            return
+        # The tiles are from another frame if the due one wasn't available, these must not be cached under the due one
+        frame_index = video.shown_frame if video.shown_frame == video.get_active_tile_index() else None
 
         if self.is_visual():
-            native_image = PILHelper.to_native_key_format(self.deck, rgb_image)
-            rgb_image.close()
+            native_image = video.get_native_tile(frame_index, index) if frame_index is not None else None
+            if native_image is None:
+                native_image = self.native_encoder.encode(tile)
+                if frame_index is not None:
+                    video.set_native_tile(frame_index, index, native_image)
             self.media_player.add_image_task(index, native_image)
 
-        del rgb_image
-        self.keys[index].set_ui_key_image(image)
+        # The tiles get closed on the next frame, so the ui needs its own copy
+        self.keys[index].set_ui_key_image(tile.copy())
 
     @log.catch
     def update_all_keys(self):
         start = time.time()
         if not self.get_alive(): return
         if self.background.video is not None:
-            log.debug("Skipping update_all_keys because there is a background video")
+            log.debug("Deferring update_all_keys to the media player because there is a background video")
+            for i in range(self.deck.key_count()):
+                self.media_player.mark_key_dirty(i)
             return
         for i in range(self.deck.key_count()):
             self.update_key(i)
@@ -369,6 +717,7 @@ class DeckController:
 
     def set_deck_key_image(self, key: int, image) -> None:
         if not self.get_alive(): return
+        self.invalidate_native_image_hash(key)
         try:
             with self.deck:
                 self.deck.set_key_image(key, image)
@@ -518,14 +867,26 @@ class DeckController:
             set_from_page(self)
 
     @log.catch
-    def load_all_keys(self, page: Page, update: bool = True):
+    def load_all_keys(self, page: Page, update: bool = True, only_keys: set[str] = None):
+        """
+        Args:
+            only_keys (set[str]): Coords of the keys to load, all keys if None
+        """
         start = time.time()
         keys_to_load = self.keys
+        if only_keys is not None:
+            keys_to_load = [key for key in self.keys if self.get_key_page_coords(key.key) in only_keys]
         with ThreadPoolExecutor() as executor:
             futures = [executor.submit(self.load_key, key.key, page, update) for key in keys_to_load]
             for future in futures:
                 future.result()
         log.info(f"Loading all keys took {time.time() - start} seconds")
+        # The new actions might have to tick
+        self.wake_up_action_ticks()
+
+    def get_key_page_coords(self, key: int) -> str:
+        coords = self.index_to_coords(key)
+        return f"{coords[0]}x{coords[1]}"
 
     def load_key(self, key: int, page: Page, update: bool = True, load_labels: bool = True, load_media: bool = True):
         if key >= self.deck.key_count():
@@ -564,7 +925,11 @@ class DeckController:
 
     @log.catch
     def load_page(self, page: Page, load_brightness: bool = True, load_screensaver: bool = True, load_background: bool = True, load_keys: bool = True,
-                  allow_reload: bool = True):
+                  allow_reload: bool = True, changed_keys: set[str] = None):
+        """
+        Args:
+            changed_keys (set[str]): If the page is already active only these keys get reloaded
+        """
         if not self.get_alive(): return
 
         start = time.time()
@@ -572,6 +937,10 @@ class DeckController:
         if not allow_reload:
             if self.active_page is page:
                 return
+
+        if changed_keys is not None and page is not None and self.active_page is page:
+            self.reload_keys(page, changed_keys)
+            return
         
         old_path = self.active_page.json_path if self.active_page is not None else None
 
@@ -593,6 +962,7 @@ class DeckController:
 
         old_tick = self.media_player.media_ticks
         old_time = time.time()
+        self.media_player.wake_up()
         while self.media_player.media_ticks <= old_tick and time.time() - old_time <= 0.5:
             time.sleep(0.05)
 
@@ -607,11 +977,14 @@ class DeckController:
         if load_screensaver:
             self.load_screensaver(page)
         if load_keys:
+            # Load the fonts before the keys so that the first render doesn't have to parse them
+            self.media_player.add_task(font_registry.warm_up, page.get_label_fonts())
             self.media_player.add_task(self.load_all_keys, page, update=False)
 
         # Load page onto deck
         # self.update_all_keys()
         self.media_player.add_task(self.update_all_keys)
+        self.media_player.add_task(self.log_page_switch_latency, page, start)
 
         # Notify plugin actions
         gl.signal_manager.trigger_signal(Signals.ChangePage, self, old_path, self.active_page.json_path)
@@ -619,6 +992,21 @@ class DeckController:
         log.info(f"Loaded page {page.get_name()} on deck {self.deck.get_serial_number()}")
         gc.collect()
 
+    def log_page_switch_latency(self, page: Page, start: float) -> None:
+        log.info(f"Switched to page {page.get_name()} on deck {self.deck.get_serial_number()} in {(time.time() - start) * 1000:.1f} ms")
+
+    def reload_keys(self, page: Page, changed_keys: set[str]) -> None:
+        """
+        Reloads the given keys of the active page, all other keys keep their current image
+        """
+        if not changed_keys:
+            log.debug(f"No keys of page {page.get_name()} changed, skipping reload")
+            return
+
+        log.info(f"Reloading {len(changed_keys)} key(s) of page {page.get_name()} on deck {self.deck.get_serial_number()}")
+        self.media_player.add_task(font_registry.warm_up, page.get_label_fonts())
+        self.media_player.add_task(self.load_all_keys, page, update=True, only_keys=changed_keys)
+
     def set_brightness(self, value):
         if not self.get_alive(): return
         self.deck.set_brightness(int(value))
@@ -627,6 +1015,12 @@ class DeckController:
     def tick_actions(self) -> None:
         time.sleep(self.TICK_DELAY)
         while self.keep_actions_ticking:
+            if not self.screen_saver.showing and not self.has_ticking_actions():
+                # Nothing to tick, sleep until the keys or the screen saver change
+                self.tick_event.wait()
+                self.tick_event.clear()
+                continue
+
             start = time.time()
             self.mark_page_ready_to_clear(False)
             if not self.screen_saver.showing and True:
@@ -648,6 +1042,22 @@ class DeckController:
     # Helper methods #
     # -------------- #
 
+    def has_ticking_actions(self) -> bool:
+        """
+        Returns True if an action on the active page implements on_tick
+        """
+        for key in self.keys:
+            active_state = key.get_active_state()
+            if active_state is None:
+                continue
+            for action in active_state.get_own_actions():
+                if isinstance(action, ActionBase) and type(action).on_tick is not ActionBase.on_tick:
+                    return True
+        return False
+
+    def wake_up_action_ticks(self) -> None:
+        self.tick_event.set()
+
     def mark_page_ready_to_clear(self, ready_to_clear: bool):
         if self.active_page is not None:
             self.active_page.ready_to_clear = ready_to_clear
@@ -686,7 +1096,8 @@ class DeckController:
         if not self.is_visual():
             return
         alpha_image = self.generate_alpha_key()
-        native_image = PILHelper.to_native_key_format(self.deck, alpha_image.convert("RGB"))
+        native_image = self.native_encoder.encode(alpha_image)
+        self.invalidate_native_image_hashes()
         for i in range(self.deck.key_count()):
             self.deck.set_key_image(i, native_image)
 
@@ -705,9 +1116,14 @@ class DeckController:
     def clear_media_player_tasks(self):
         ticks = self.media_player.media_ticks
         self.media_player.tasks.clear()
-        self.media_player.image_tasks.clear()
-
-        # Wait until tick is over
+        self.deck_writer.clear()
+        # Dropped writes never reached the keys
+        self.invalidate_native_image_hashes()
+        with self.media_player.dirty_keys_lock:
+            self.media_player.dirty_keys.clear()
+
+        # Wait until tick is over, the thread might be idle
+        self.media_player.wake_up()
         while self.media_player.media_ticks <= ticks:
             time.sleep(1/60)
 
@@ -728,7 +1144,11 @@ class DeckController:
         if hasattr(self, "media_player"):
             self.media_player.stop()
 
+        if hasattr(self, "deck_writer"):
+            self.deck_writer.stop()
+
         self.keep_actions_ticking = False
+        self.wake_up_action_ticks()
         self.deck.run_read_thread = False
 
     def get_alive(self) -> bool:
@@ -766,6 +1186,9 @@ class Background:
         self.video = video
         gc.collect()
 
+        # Start playing even if the media player is idle
+        self.deck_controller.media_player.wake_up()
+
         self.update_tiles()
         if update:
             self.deck_controller.update_all_keys()
@@ -784,9 +1207,11 @@ class Background:
             if allow_keep:
                 if self.video is not None and self.video.video_path == path:
                     self.video.page = self.deck_controller.active_page
-                    self.video.fps = fps
-                    self.video.loop = loop
+                    self.video.set_playback(fps=fps, loop=loop)
                     return
+            if self.video is not None:
+                # The old video gets closed by set_video, its reservation must not count against the new one
+                self.video.release_budget()
             self.set_video(BackgroundVideo(self.deck_controller, path, loop=loop, fps=fps), update=update)
         else:
             if path is None:
@@ -805,80 +1230,42 @@ class Background:
         else:
             self.tiles = [self.deck_controller.generate_alpha_key() for _ in range(self.deck_controller.deck.key_count())]
 
+        # The prefetcher returns the same tiles again if the frame didn't change
+        shown_tiles = {id(tile) for tile in self.tiles}
         for tile in old_tiles:
-            if tile is not None:
+            if tile is not None and id(tile) not in shown_tiles:
                 tile.close()
                 tile = None
                 del tile
         del old_tiles
+
+    def get_tile_id(self) -> tuple:
+        """
+        Returns an id of the currently shown tiles. It changes whenever the tiles show something else.
+        """
+        if self.image is not None:
+            return ("image", id(self.image), self.image.generation)
+        if self.video is not None:
+            return ("video", self.video.video_path, self.video.active_frame)
+        return ("none",)
         
 
 class BackgroundImage:
+    # Used to tell background images apart in the composite cache
+    _generation_counter = itertools.count()
+
     def __init__(self, deck_controller: DeckController, image: Image) -> None:
         self.deck_controller = deck_controller
         self.image = image
+        self.generation: int = next(BackgroundImage._generation_counter)
 
-    def create_full_deck_sized_image(self) -> Image:
-        key_rows, key_cols = self.deck_controller.deck.key_layout()
-        key_width, key_height = self.deck_controller.get_key_image_size()
-        spacing_x, spacing_y = 36, 36
-
-        key_width *= key_cols
-        key_height *= key_rows
-
-        # Compute the total number of extra non-visible pixels that are obscured by
-        # the bezel of the StreamDeck.
-        spacing_x *= key_cols - 1
-        spacing_y *= key_rows - 1
-
-        # Compute final full deck image size, based on the number of buttons and
-        # obscured pixels.
-        full_deck_image_size = (key_width + spacing_x, key_height + spacing_y)
-
-        # Resize the image to suit the StreamDeck's full image size. We use the
-        # helper function in Pillow's ImageOps module so that the image's aspect
-        # ratio is preserved.
-        return ImageOps.fit(self.image, full_deck_image_size, Image.LANCZOS)
-    
-    def crop_key_image_from_deck_sized_image(self, image: Image.Image, key):
-        key_spacing = (36, 36)
-        deck = self.deck_controller.deck
-
-
-        key_rows, key_cols = deck.key_layout()
-        key_width, key_height = deck.key_image_format()['size']
-        spacing_x, spacing_y = key_spacing
-
-        # Determine which row and column the requested key is located on.
-        row = key // key_cols
-        col = key % key_cols
-
-        # Compute the starting X and Y offsets into the full size image that the
-        # requested key should display.
-        start_x = col * (key_width + spacing_x)
-        start_y = row * (key_height + spacing_y)
-
-        # Compute the region of the larger deck image that is occupied by the given
-        # key, and crop out that segment of the full image.
-        region = (start_x, start_y, start_x + key_width, start_y + key_height)
-        segment = image.crop(region)
-
-        # Create a new key-sized image, and paste in the cropped section of the
-        # larger image.
-        key_image = PILHelper.create_key_image(deck)
-        key_image.paste(segment)
-
-        return key_image
-    
     def get_tiles(self) -> list[Image.Image]:
-        full_deck_sized_image = self.create_full_deck_sized_image()
-
-        tiles: list[Image.Image] = []
-        for key in range(self.deck_controller.deck.key_count()):
-            key_image = self.crop_key_image_from_deck_sized_image(full_deck_sized_image, key)
-            tiles.append(key_image)
-
-        return tiles
+        tiler = KeyTiler(
+            key_layout=self.deck_controller.deck.key_layout(),
+            key_size=self.deck_controller.get_key_image_size(),
+            spacing=self.deck_controller.spacing
+        )
+        return tiler.get_tiles_from_image(self.image, interpolation=cv2.INTER_LANCZOS4)
 
 
 class BackgroundVideo(BackgroundVideoCache):
@@ -891,23 +1278,65 @@ class BackgroundVideo(BackgroundVideoCache):
         self.page: Page = self.deck_controller.active_page
 
         self.active_frame: int = -1
+        # Index of the frame the current tiles are actually from, None if no frame was available
+        self.shown_frame: int = None
 
         super().__init__(video_path, deck_controller=deck_controller)
 
-    def get_next_tiles(self) -> list[Image.Image]:
-        # return [self.deck_controller.generate_alpha_key() for _ in range(self.deck_controller.deck.key_count())]
-        self.active_frame += 1
+        # Decodes the next frames on its own thread so that the media thread only has to pick them up
+        self.prefetcher = FramePrefetcher(
+            produce=self.produce_tiles,
+            n_frames=self.n_frames,
+            loop=self.loop,
+            depth=gl.settings_manager.get_app_settings().get("performance", {}).get("video-prefetch-frames", 8),
+            name="background_video_prefetcher"
+        )
 
-        if self.active_frame >= self.n_frames:
-            if self.loop:
-                self.active_frame = 0
+        # Plays the video at its own frame rate, fps only limits how often new tiles are shown
+        self.clock = FrameClock(
+            n_frames=self.n_frames,
+            fps=self.native_fps,
+            loop=self.loop,
+            max_fps=min(self.fps, self.deck_controller.media_player.FPS)
+        )
 
-        tiles =  self.get_tiles(self.active_frame)
+    def set_playback(self, fps: int, loop: bool) -> None:
+        """
+        Changes the presentation rate and looping of the playing video
+        """
+        self.fps = fps
+        self.loop = loop
+        self.clock.set_max_fps(min(self.fps, self.deck_controller.media_player.FPS))
+        self.clock.set_loop(self.loop)
+        self.prefetcher.loop = self.loop
+        # Schedule the next frame with the new settings, even if the media player is idle
+        self.deck_controller.media_player.wake_up()
+
+    def produce_tiles(self, n: int) -> tuple[list[Image.Image], int]:
+        tiles, frame_index = self.get_indexed_tiles(n)
         try:
             copied_tiles = [tile.copy() for tile in tiles]
         except:
             copied_tiles = [None for _ in range(len(tiles))]
-        return copied_tiles
+        return copied_tiles, frame_index
+
+    def get_next_tiles(self) -> list[Image.Image]:
+        # return [self.deck_controller.generate_alpha_key() for _ in range(self.deck_controller.deck.key_count())]
+        # The frame that is due now, frames in between are dropped by the prefetcher
+        frame_index = self.clock.get_frame_index()
+        if frame_index < self.active_frame:
+            # All native tiles of a loop are known now
+            self.native_tile_cache.save_threaded()
+        self.active_frame = frame_index
+
+        self.prefetcher.loop = self.loop
+        produced = self.prefetcher.get(self.get_active_tile_index())
+        if produced is None:
+            # Producing the tiles failed
+            self.shown_frame = None
+            return [self.deck_controller.generate_alpha_key() for _ in range(self.deck_controller.deck.key_count())]
+        tiles, self.shown_frame = produced
+        return tiles
 
         frame = self.get_next_frame()
         frame_full_sized_image = self.create_full_deck_sized_image(frame)
@@ -927,6 +1356,22 @@ class BackgroundVideo(BackgroundVideoCache):
                 self.active_frame = 0
         
         return self.get_frame(self.active_frame)
+
+    def is_frame_due(self, now_ns: int) -> bool:
+        return self.clock.poll(now_ns)
+
+    def get_next_deadline(self) -> int:
+        return self.clock.next_deadline_ns
+
+    def get_active_tile_index(self) -> int:
+        """
+        Returns the index of the frame the current tiles are from
+        """
+        return max(0, min(self.active_frame, self.n_frames - 1))
+
+    def close(self) -> None:
+        self.prefetcher.close()
+        super().close()
     
     def create_full_deck_sized_image(self, frame: Image.Image) -> Image.Image:
         key_rows, key_cols = self.deck_controller.deck.key_layout()
@@ -992,18 +1437,29 @@ class KeyGIF(SingleKeyAsset):
 
         self.gif = Image.open(self.gif_path)
         self.gif = ImageSequence.Iterator(self.gif)
-        self.frames = [frame.convert("RGBA") for frame in self.gif]
+        self.frames: list[Image.Image] = []
+        durations: list[float] = []
+        for frame in self.gif:
+            self.frames.append(frame.convert("RGBA"))
+            durations.append(frame.info.get("duration"))
+
+        # Plays the gif with the durations of its frames, fps only limits how often a new frame is shown
+        self.clock = FrameClock(
+            n_frames=len(self.frames),
+            frame_durations_ms=durations,
+            loop=self.loop,
+            max_fps=min(self.fps, self.deck_controller.media_player.FPS)
+        )
 
     def get_next_frame(self) -> Image.Image:
-        self.active_frame += 1
+        self.active_frame = min(self.clock.get_frame_index(), len(self.frames) - 1)
+        return self.frames[self.active_frame]
 
-        if self.active_frame >= len(self.frames):
-            if self.loop:
-                self.active_frame = 0
-            else:
-                self.active_frame = len(self.frames) - 1
+    def is_frame_due(self, now_ns: int) -> bool:
+        return self.clock.poll(now_ns)
 
-        return self.frames[self.active_frame]
+    def get_next_deadline(self) -> int:
+        return self.clock.next_deadline_ns
         self.gif.convert("RGBA")
     
     def get_raw_image(self) -> Image.Image:
@@ -1022,6 +1478,9 @@ class ControllerKeyLabelManager:
         self.page_labels = {}
         self.action_labels = {}
 
+        # position: (layer key, rendered label layer)
+        self.label_layers: dict[str, tuple[tuple, Image.Image]] = {}
+
         self.init_labels()
 
     def init_labels(self):
@@ -1031,6 +1490,7 @@ class ControllerKeyLabelManager:
  
     def clear_labels(self):
         self.init_labels()
+        self.label_layers.clear()
 
     def set_page_label(self, position: str, label: "KeyLabel", update: bool = True):
         if label is None:
@@ -1041,6 +1501,8 @@ class ControllerKeyLabelManager:
             label.font_size = None
         else:
             self.page_labels[position] = label
+
+        self.label_layers.pop(position, None)
         
         if update:
             self.update_label(position)
@@ -1055,6 +1517,8 @@ class ControllerKeyLabelManager:
         else:
             self.action_labels[position] = label
 
+        self.label_layers.pop(position, None)
+
         self.update_label_editor()
 
         if update:
@@ -1134,6 +1598,21 @@ class ControllerKeyLabelManager:
         return label
 
 
+    def get_label_layer(self, position: str, label: "KeyLabel", size: tuple[int, int]) -> Image.Image:
+        """
+        Returns the rendered layer of the given composed label.
+        The layer is kept until the label of this position changes.
+        """
+        layer_key = label_layer_cache.get_layer_key(label, position, size)
+        cached = self.label_layers.get(position)
+        # Compare the keys as well because pages can edit the labels in place
+        if cached is not None and cached[0] == layer_key:
+            return cached[1]
+
+        layer = label_layer_cache.get_layer(label, position, size)
+        self.label_layers[position] = (layer_key, layer)
+        return layer
+
     def update_label(self, position: str):
         self.controller_key.update()
 
@@ -1407,6 +1886,64 @@ class ControllerKey:
 
         return labeled_image
     
+    def shows_only_background_tile(self) -> bool:
+        """
+        Returns True if the key shows its background tile without any other layers
+        """
+        state = self.get_active_state()
+        if state.key_image is not None or state.key_video is not None:
+            return False
+        if state.background_color[-1] > 0:
+            return False
+        if self.is_pressed() or self._show_error:
+            return False
+        for label in state.label_manager.get_composed_labels().values():
+            if label.text not in [None, ""]:
+                return False
+        return not self.has_unavailable_action()
+
+    def get_image_fingerprint(self) -> tuple:
+        """
+        Returns a fingerprint of all layers that make up the current deck image.
+        Returns None if the image can't be cached, e.g. because a key or background video is playing.
+        """
+        state = self.get_active_state()
+
+        if state.key_video is not None:
+            return
+
+        tile_id = None
+        if state.background_color[-1] < 255:
+            if self.deck_controller.background.video is not None:
+                # Every frame would be a new entry that never gets hit again and pushes out the static keys
+                return
+            tile_id = self.deck_controller.background.get_tile_id()
+
+        media_id = None
+        if state.key_image is not None:
+            media_id = state.key_image.get_content_id()
+
+        layout = state.layout_manager.get_composed_layout()
+        layout_fingerprint = (layout.valign, layout.halign, layout.fill_mode, layout.size)
+
+        labels = state.label_manager.get_composed_labels()
+        labels_fingerprint = tuple(
+            (position, label.text, tuple(label.color), label.font_name, label.font_size)
+            for position, label in labels.items()
+        )
+
+        return (
+            self.key,
+            tile_id,
+            media_id,
+            layout_fingerprint,
+            labels_fingerprint,
+            tuple(state.background_color),
+            self.is_pressed(),
+            self._show_error,
+            self.has_unavailable_action()
+        )
+
     def add_warning_point(self, image: Image.Image, margin: int = 10, size: int = 10, color: tuple = (255, 150, 80)) -> Image.Image:
         draw = ImageDraw.Draw(image)
 
@@ -1458,6 +1995,8 @@ class ControllerKey:
         self.get_own_ui_key().state = state
 
         self.get_active_state().own_actions_ready()
+        # The actions of the new state might have to tick
+        self.deck_controller.wake_up_action_ticks()
 
         if update_key:
             self.update()
@@ -1486,48 +2025,23 @@ class ControllerKey:
     
 
     def add_labels_to_image(self, _image: Image.Image) -> Image.Image:
-        # image = _image.copy()
-        # _image.close()
+        # The labels are pre-rendered into transparent layers, so they only have to be composited here
         image = _image
-        # image = Image.new("RGBA", _image.size, (0, 0, 0, 0))
-
-        # image = Image.frombytes("RGBA", _image.size, _image.tobytes())
-
-        draw = ImageDraw.Draw(image)
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        else:
+            image = image.copy()
 
-        # labels = copy(self.labels) # Prevent crash if labels change during iteration
-        labels = self.get_active_state().label_manager.get_composed_labels()
+        label_manager = self.get_active_state().label_manager
+        labels = label_manager.get_composed_labels()
 
-        for label in labels:
-            text = labels[label].text
-            if text in [None, ""]:
+        for position in labels:
+            if labels[position].text in [None, ""]:
                 continue
-            # text = "text"
-            font_path = labels[label].get_font_path()
-            color = tuple(labels[label].color)
-            font_size = labels[label].font_size
-            font = ImageFont.truetype(font_path, font_size)
-
-            _, _, w, h = draw.textbbox((0, 0), text, font=font)
+            layer = label_manager.get_label_layer(position, labels[position], image.size)
+            image.alpha_composite(layer)
 
-            if label == "top":
-                position = (image.width / 2, h/2 + 3)
-
-            if label == "center":
-                position = ((image.width - 0) / 2, (image.height - 0) / 2)
-
-            if label == "bottom":
-                position = (image.width / 2, image.height - h/2 - 3)
-
-            draw.text(position,
-                        text=text, font=font, anchor="mm", align="center",
-                        fill=color, stroke_width=2,
-                        stroke_fill="black")
-            
-        draw = None
-        del draw
-
-        return image.copy()
+        return image
     
     def is_pressed(self) -> bool:
         return self.press_state
@@ -1596,7 +2110,7 @@ class ControllerKey:
             ## Load media - why here? so that it doesn't overwrite the images chosen by the actions
             if load_media:
                 state.key_image = None
-                state.key_video = None
+                state.close_key_video()
             
             if load_labels:
                 state.label_manager.clear_labels()
@@ -1625,18 +2139,11 @@ class ControllerKey:
             if load_media:
                 path = state_dict.get("media", {}).get("path", None)
                 if path not in ["", None]:
-                    if is_image(path):
-                        with Image.open(path) as image:
-                            state.set_key_image(KeyImage(
-                                controller_key=self,
-                                image=image.copy()
-                            ), update=False)
-                            
-                    elif is_svg(path):
-                        img = load_svg_as_pil(path)
+                    if is_image(path) or is_svg(path):
+                        # Only decoded if no key sized version is cached
                         state.set_key_image(KeyImage(
                             controller_key=self,
-                            image=img
+                            path=path
                         ), update=False)
 
                     elif is_video(path) and True:
@@ -1696,7 +2203,7 @@ class ControllerKey:
     def clear(self, update: bool = True):
         active_state = self.get_active_state()
         active_state.key_image = None
-        active_state.key_video = None
+        active_state.close_key_video()
         active_state.label_manager.clear_labels()
         active_state.layout_manager.clear()
         active_state.background_color = [0, 0, 0, 0]
@@ -1808,6 +2315,14 @@ class ControllerKeyState:
             self.key_video = None
             del self.key_video
 
+    def close_key_video(self) -> None:
+        """
+        Closes and removes the key video, it holds its frame store, a pin against pruning and a decoder thread
+        """
+        if self.key_video is not None:
+            self.key_video.close()
+        self.key_video = None
+
     def get_own_actions(self) -> list["ActionBase"]:
         if not self.deck_controller.get_alive(): return []
         active_page = self.deck_controller.active_page
@@ -1827,17 +2342,22 @@ class ControllerKeyState:
             self.key_image.close()
 
         self.key_image = key_image
-        self.key_video = None
+        self.close_key_video()
 
         if update:
             self.update()
 
     def set_key_video(self, key_video: "KeyVideo") -> None:
+        if key_video is not self.key_video:
+            self.close_key_video()
         self.key_video = key_video
         if self.key_image is not None:
             self.key_image.close()
         self.key_image = None
 
+        # Start playing even if the media player is idle
+        self.deck_controller.media_player.wake_up()
+
     def remove_label(self, position: str = "center", update: bool = True) -> None:
         if position not in ["top", "center", "bottom"]:
             log.error(f"Invalid position: {position}, must be one of 'top', 'center', or 'bottom'.")
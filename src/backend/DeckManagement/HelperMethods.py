@@ -12,7 +12,6 @@ This programm comes with ABSOLUTELY NO WARRANTY!
 You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
-import hashlib
 import os
 import matplotlib.font_manager
 import sys
@@ -27,6 +26,8 @@ from PIL import Image
 # Import globals
 import globals as gl
 
+from src.backend.FingerprintService import fingerprint_service
+
 def sha256(file_path):
     """
     Calculates the sha256 hash of a file.
@@ -37,13 +38,8 @@ def sha256(file_path):
     Returns:
         str: The sha256 hash of the file.
     """
-    hash_sha256 = hashlib.sha256()
-    if not os.path.exists(file_path):
-        return
-    with open(file_path, "rb") as f:
-        for chunk in iter(lambda: f.read(4096), b""):
-            hash_sha256.update(chunk)
-    return hash_sha256.hexdigest()
+    # Unchanged files are not hashed again
+    return fingerprint_service.get_digest(file_path, "sha256")
 
 def file_in_dir(file_path, directory) -> None:
     """
@@ -13,6 +13,7 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 from src.backend.DeckManagement.Subclasses.SingleKeyAsset import SingleKeyAsset
+from src.backend.DeckManagement.Subclasses.media_image_cache import media_image_cache
 from PIL import Image
 
 from typing import TYPE_CHECKING
@@ -20,13 +21,15 @@ if TYPE_CHECKING:
     from src.backend.DeckManagement.DeckController import ControllerKey
 
 class KeyImage(SingleKeyAsset):
-    def __init__(self, controller_key: "ControllerKey", image: Image.Image):
+    def __init__(self, controller_key: "ControllerKey", image: Image.Image = None, path: str = None):
         """
         Initialize the class with the given controller key, image, fill mode, size, vertical alignment, and horizontal alignment.
 
         Parameters:
             controller_key (ControllerKey): The key of the controller.
             image (Image.Image): The image to be displayed.
+            path (str, optional): Path of the image file to be displayed instead of image. The file only gets decoded if no
+                key sized version of it is cached.
             fill_mode (str, optional): The mode for filling the image. Defaults to "cover".
             size (float, optional): The size of the image. Defaults to 1.
             valign (float, optional): The vertical alignment of the image. Defaults to 0. Ranges from -1 to 1.
@@ -34,20 +37,47 @@ class KeyImage(SingleKeyAsset):
         """
         super().__init__(controller_key)
         self.image = image
+        self.path = path
 
-        if self.image is None:
+        if self.image is None and self.path is None:
             self.image = self.controller_key.deck_controller.generate_alpha_key()
 
+        # Images loaded from the same unchanged file show the same content, even after a reload of the page
+        self.content_id: tuple = None
+        if self.image is None:
+            # The file might have changed since it was shown last, renders use the size and mtime read here
+            media_image_cache.refresh({self.path})
+            try:
+                self.content_id = ("file", *media_image_cache.get_cache_key(self.path))
+            except OSError:
+                pass
+
     def get_raw_image(self) -> Image.Image:
         if not hasattr(self, "image"):
             return
+        if self.image is None and self.path is not None:
+            # Only decoded when needed
+            self.image = media_image_cache.get(self.path)
         return self.image
+
+    def get_content_id(self) -> tuple:
+        if self.content_id is not None:
+            return self.content_id
+        return super().get_content_id()
+
+    def get_resized_foreground(self, fill_mode: str, size: tuple[int, int]) -> Image.Image:
+        if self.path is not None:
+            resized = media_image_cache.get_scaled(self.path, fill_mode, size)
+            if resized is not None:
+                return resized
+        return super().get_resized_foreground(fill_mode, size)
     
     def close(self) -> None:
         if not hasattr(self, "image"):
             # Already closed
             return
-        self.image.close()
+        if self.image is not None:
+            self.image.close()
         self.image = None
         del self.image
         return
\ No newline at end of file
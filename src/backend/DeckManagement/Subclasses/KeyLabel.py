@@ -14,8 +14,9 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 from src.backend.DeckManagement.Subclasses.SingleKeyAsset import SingleKeyAsset
 from PIL import Image
+from src.backend.DeckManagement.Subclasses.font_registry import font_registry
 from dataclasses import dataclass
-import matplotlib.font_manager
+from PIL import ImageFont
 
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -30,4 +31,7 @@ class KeyLabel:
     color: list[int] = None
 
     def get_font_path(self) -> str:
-        return matplotlib.font_manager.findfont(matplotlib.font_manager.FontProperties(family=self.font_name))
\ No newline at end of file
+        return font_registry.get_font_path(self.font_name)
+    
+    def get_font(self) -> ImageFont.FreeTypeFont:
+        return font_registry.get_font(self.font_name, self.font_size)
\ No newline at end of file
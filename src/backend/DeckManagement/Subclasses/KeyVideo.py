@@ -14,8 +14,12 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 from src.backend.DeckManagement.Subclasses.SingleKeyAsset import SingleKeyAsset
 from src.backend.DeckManagement.Subclasses.key_video_cache import VideoFrameCache
+from src.backend.DeckManagement.Subclasses.frame_prefetcher import FramePrefetcher
+from src.backend.DeckManagement.Subclasses.frame_clock import FrameClock
 from PIL import Image
 
+import globals as gl
+
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
     from src.backend.DeckManagement.DeckController import ControllerKey
@@ -29,20 +33,74 @@ class KeyVideo(SingleKeyAsset):
         self.fps = fps
         self.loop = loop
 
-        self.video_cache = VideoFrameCache(video_path)
-
         self.active_frame: int = -1
 
+        # Frames are stored in the size they are shown in, so playing them doesn't need any resampling.
+        # This is the key size until the first render tells the size of the layout.
+        self.frame_size: tuple[int, int] = tuple(controller_key.deck_controller.get_key_image_size())
+        self.video_cache: VideoFrameCache = None
+        self.prefetcher: FramePrefetcher = None
+        self.open_frame_cache()
+
+        # Plays the video at its own frame rate, fps only limits how often a new frame is shown
+        self.clock = FrameClock(
+            n_frames=self.video_cache.n_frames,
+            fps=self.video_cache.native_fps,
+            loop=self.loop,
+            max_fps=min(self.fps, controller_key.deck_controller.media_player.FPS)
+        )
+
+    def open_frame_cache(self) -> None:
+        self.video_cache = VideoFrameCache(self.video_path, deck_serial=self.controller_key.deck_controller.serial_number(),
+                                           frame_size=self.frame_size)
+
+        # Decodes the next frames on its own thread so that the media thread only has to pick them up
+        self.prefetcher = FramePrefetcher(
+            produce=self.video_cache.get_frame,
+            n_frames=self.video_cache.n_frames,
+            loop=self.loop,
+            depth=gl.settings_manager.get_app_settings().get("performance", {}).get("video-prefetch-frames", 8),
+            start=max(0, self.active_frame + 1),
+            name="key_video_prefetcher"
+        )
+
+    def set_frame_size(self, frame_size: tuple[int, int]) -> None:
+        """
+        Switches to the frame cache of the given size, e.g. after the layout size of the key changed
+        """
+        self.prefetcher.close()
+        self.video_cache.close()
+        self.frame_size = tuple(frame_size)
+        self.open_frame_cache()
 
     def get_next_frame(self) -> Image:
-        self.active_frame += 1
+        # The frame that is due now, frames in between are dropped by the prefetcher
+        self.active_frame = self.clock.get_frame_index()
+        return self.prefetcher.get(min(self.active_frame, self.video_cache.n_frames - 1))
+
+    def is_frame_due(self, now_ns: int) -> bool:
+        return self.clock.poll(now_ns)
 
-        if self.active_frame >= self.video_cache.n_frames:
-            if self.loop:
-                self.active_frame = 0
-        
-        return self.video_cache.get_frame(self.active_frame).resize(self.controller_key.deck_controller.get_key_image_size(), Image.Resampling.LANCZOS)
+    def get_next_deadline(self) -> int:
+        return self.clock.next_deadline_ns
+
+    def get_resized_foreground(self, fill_mode: str, size: tuple[int, int]) -> Image.Image:
+        size = tuple(size)
+        if size != self.frame_size:
+            self.set_frame_size(size)
+
+        frame = self.get_next_frame()
+        if frame is None:
+            frame = self.deck_controller.generate_alpha_key()
+        if frame.size == size:
+            # The frames fill the size completely, so all fill modes result in the frame itself
+            return frame
+        return self.resize_foreground(frame, fill_mode, size)
     
     def get_raw_image(self) -> Image.Image:
         return self.get_next_frame()
+
+    def close(self) -> None:
+        self.prefetcher.close()
+        self.video_cache.close()
      
\ No newline at end of file
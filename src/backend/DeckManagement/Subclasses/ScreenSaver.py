@@ -93,6 +93,8 @@ class ScreenSaver:
         self.timer.cancel()
         # Set showing = True - in case this method is called manually
         self.showing = True
+        # The keys get updated on every action tick while the screen saver is showing
+        self.deck_controller.wake_up_action_ticks()
 
         # Store original keys and background
         self.original_keys = self.deck_controller.keys
@@ -112,8 +114,7 @@ class ScreenSaver:
         self.deck_controller.background.set_from_path(self.media_path, update=True)
 
         if self.deck_controller.background.video is not None:
-            self.deck_controller.background.video.fps = self.fps
-            self.deck_controller.background.video.loop = self.loop
+            self.deck_controller.background.video.set_playback(fps=self.fps, loop=self.loop)
 
     def hide(self):
         log.info("Hiding screen saver")
@@ -14,6 +14,8 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
 from PIL import Image, ImageOps, ImageDraw, ImageFont
+from src.backend.DeckManagement.Subclasses.font_registry import font_registry
+import itertools
 import os
 
 from typing import TYPE_CHECKING
@@ -21,10 +23,21 @@ if TYPE_CHECKING:
     from src.backend.DeckManagement.DeckController import ControllerKey
 
 class SingleKeyAsset:
+    # Used to give every asset a unique id - id() can be reused after an object got garbage collected
+    _id_counter = itertools.count()
+
     def __init__(self, controller_key: "ControllerKey"):
         self.controller_key = controller_key
         self.deck_controller = controller_key.deck_controller
 
+        self.asset_id: int = next(SingleKeyAsset._id_counter)
+
+    def get_content_id(self) -> tuple:
+        """
+        Returns an id of the shown content for the composite cache, assets showing the same content should return the same id
+        """
+        return ("asset", self.asset_id)
+
     def get_raw_image(self) -> Image.Image:
         return Image.open(os.path.join("Assets", "images", "error.png"))
     
@@ -37,10 +50,9 @@ class SingleKeyAsset:
             if text in [None, ""]:
                 continue
             # text = "text"
-            font_path = labels[label].get_font_path()
             color = tuple(labels[label].color)
             font_size = labels[label].font_size
-            font = ImageFont.truetype(font_path, font_size)
+            font = labels[label].get_font()
             font_weight = labels[label].font_weight
 
             if text is None:
@@ -56,33 +68,41 @@ class SingleKeyAsset:
                 position = (image.width / 2, image.height*0.875)
 
 
-            draw.text(position,
-                        text=text, font=font, anchor="ms",
-                        fill=color, stroke_width=font_weight)
+            # The font is shared with other threads
+            with font_registry.render_lock:
+                draw.text(position,
+                            text=text, font=font, anchor="ms",
+                            fill=color, stroke_width=font_weight)
             
         draw = None
         del draw
 
         return image.copy()
-    
-    def generate_final_image(self, background: Image.Image = None, labels: dict = {}) -> Image.Image:
-        layout = self.controller_key.get_active_state().layout_manager.get_composed_layout()
 
+    def get_resized_foreground(self, fill_mode: str, size: tuple[int, int]) -> Image.Image:
         foreground = self.get_raw_image()
         if foreground is None:
             foreground = self.deck_controller.generate_alpha_key()
+        return self.resize_foreground(foreground, fill_mode, size)
 
-        img_size = self.deck_controller.get_key_image_size()
-        scaled_img_size = (int(img_size[0] * layout.size), int(img_size[1] * layout.size))  # Calculate scaled size of the image
+    @staticmethod
+    def resize_foreground(foreground: Image.Image, fill_mode: str, size: tuple[int, int]) -> Image.Image:
+        if fill_mode == "stretch":
+            return foreground.resize(size, Image.Resampling.HAMMING)
 
-        if layout.fill_mode == "stretch":
-            foreground_resized = foreground.resize(scaled_img_size, Image.Resampling.HAMMING)
+        elif fill_mode == "cover":
+            return ImageOps.cover(foreground, size, Image.Resampling.HAMMING)
 
-        elif layout.fill_mode == "cover":
-            foreground_resized = ImageOps.cover(foreground, scaled_img_size, Image.Resampling.HAMMING)
+        elif fill_mode == "contain":
+            return ImageOps.contain(foreground, size, Image.Resampling.HAMMING)
+    
+    def generate_final_image(self, background: Image.Image = None, labels: dict = {}) -> Image.Image:
+        layout = self.controller_key.get_active_state().layout_manager.get_composed_layout()
+
+        img_size = self.deck_controller.get_key_image_size()
+        scaled_img_size = (int(img_size[0] * layout.size), int(img_size[1] * layout.size))  # Calculate scaled size of the image
 
-        elif layout.fill_mode == "contain":
-            foreground_resized = ImageOps.contain(foreground, scaled_img_size, Image.Resampling.HAMMING)
+        foreground_resized = self.get_resized_foreground(layout.fill_mode, scaled_img_size)
 
         # Adjust the calculation for margins so that halign and valign of 0 will center the foreground
         halign = layout.halign if layout.size <= 1 else -layout.halign
@@ -96,7 +116,7 @@ class SingleKeyAsset:
         final_image.paste(background, (0, 0))  # Paste the background onto the composite image
 
         # Paste the resized foreground onto the final image at the calculated position
-        final_image.paste(foreground_resized, (left_margin, top_margin), foreground_resized if foreground.mode == "RGBA" else None)
+        final_image.paste(foreground_resized, (left_margin, top_margin), foreground_resized if foreground_resized.mode == "RGBA" else None)
 
         return final_image
     
@@ -1,14 +1,15 @@
-import bz2
-import hashlib
 import os
-import pickle
 import sys
 import threading
 import time
 from PIL import Image, ImageOps
 import cv2
 from StreamDeck.ImageHelpers import PILHelper
-import indexed_bzip2 as ibz2
+from src.backend.DeckManagement.Subclasses.key_tiler import KeyTiler
+from src.backend.DeckManagement.Subclasses.native_tile_cache import NativeTileCache
+from src.backend.DeckManagement.Subclasses.raw_frame_store import RawFrameStore, prune_frame_stores_threaded, remove_stale_stores
+from src.backend.DeckManagement.Subclasses.video_cache_budget import video_cache_budget
+from src.backend.DeckManagement.Subclasses.video_decode_broker import SharedVideoDecoder, video_decode_broker
 from loguru import logger as log
 
 import globals as gl
@@ -16,6 +17,9 @@ import globals as gl
 VID_CACHE = os.path.join(gl.DATA_PATH, "cache", "videos")
 os.makedirs(VID_CACHE, exist_ok=True)
 
+# Videos that get less of the memory budget than this are streamed instead
+MIN_RESIDENT_FRAMES = 30
+
 # Import typing
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -27,216 +31,184 @@ class BackgroundVideoCache:
         self.lock = threading.Lock()
 
         self.video_path = video_path
-        self.cap = cv2.VideoCapture(video_path)
-        self.n_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.cache = {}
-        self.last_decoded_frame = None
-        self.last_frame_index = -1
+        # Decoded tiles are written into a memory mapped file, opening it doesn't read any frames
+        self.frame_store: RawFrameStore = None
+        # The decoder is shared with all other decks showing this video
+        self.decoder: SharedVideoDecoder = video_decode_broker.acquire(video_path, self)
+        self.n_frames = self.decoder.n_frames
+        self.native_fps = self.decoder.fps
 
-        self.video_md5 = self.get_video_hash()
+        self.video_md5 = self.decoder.video_hash
 
         self.key_layout = self.deck_controller.deck.key_layout()
         self.key_layout_str = f"{self.key_layout[0]}x{self.key_layout[1]}"
         self.key_count = self.deck_controller.deck.key_count()
-        self.key_size = self.deck_controller.deck.key_image_format()['size']
+        self.key_size = self.deck_controller.get_key_image_size()
         self.spacing = self.deck_controller.spacing
 
-        self.cache_stored = False
-
-        thread = threading.Thread(target=self.load_cache, name="load_video_cache")
-        thread.start()
+        self.tiler = KeyTiler(key_layout=self.key_layout, key_size=self.key_size, spacing=self.spacing)
+
+        performance_settings = gl.settings_manager.get_app_settings().get("performance", {})
+        self.do_caching = performance_settings.get("cache-videos", True)
+
+        # Number of frames kept in memory, None if the whole video fits into the budget
+        self.resident_frames: int = None
+        self.window_start: int = None
+        self.deck_serial = self.deck_controller.serial_number()
+        if self.do_caching:
+            self.remove_legacy_cache()
+
+            video_cache_budget.load_limits_from_settings(performance_settings)
+            frame_bytes = self.key_layout[0] * self.key_layout[1] * self.key_size[0] * self.key_size[1] * RawFrameStore.CHANNELS
+            video_bytes = self.n_frames * frame_bytes
+            granted = video_cache_budget.reserve(self.deck_serial, id(self), video_bytes)
+            if granted < video_bytes:
+                self.resident_frames = granted // frame_bytes
+
+            if self.resident_frames is None or self.resident_frames >= MIN_RESIDENT_FRAMES:
+                self.frame_store = RawFrameStore(
+                    path=self.get_frame_store_path(),
+                    n_frames=self.n_frames,
+                    key_count=self.key_layout[0] * self.key_layout[1],
+                    key_size=self.key_size
+                )
+                # Tiles of key sizes that haven't been shown for a long time are outdated, the layout changed
+                remove_stale_stores(self.frame_store.path, f"{self.video_md5}-")
+                # Keep the frame stores of all videos within their disk limit
+                prune_frame_stores_threaded(VID_CACHE, int(performance_settings.get("video-frame-cache-mb", 4096) * 1024 * 1024))
+            else:
+                video_cache_budget.release(self.deck_serial, id(self))
+                log.info(f"Video cache budget exceeded, streaming {video_path}")
 
         if self.is_cache_complete():
-            log.info("Cache is complete. Closing the video capture.")
-            self.release()
+            log.info("Cache is complete. Releasing the video decoder.")
+            self.release_decoder()
         else:
             log.info("Cache is not complete. Continuing with video capture.")
 
         self.last_tiles: list[Image.Image] = []
-
-        self.do_caching = gl.settings_manager.get_app_settings().get("performance", {}).get("cache-videos", True)
+        # Index of the frame last_tiles are from
+        self.last_tiles_index: int = None
+
+        # Device native images of keys that show nothing but their tile
+        self.native_tile_cache = NativeTileCache(
+            video_md5=self.video_md5,
+            key_layout_str=self.key_layout_str,
+            image_format=self.deck_controller.deck.key_image_format(),
+            enabled=self.do_caching and performance_settings.get("cache-native-video-frames", True),
+            max_bytes=int(performance_settings.get("native-video-cache-mb", 256) * 1024 * 1024)
+        )
 
     def get_tiles(self, n):
+        return self.get_indexed_tiles(n)[0]
+
+    def get_indexed_tiles(self, n: int) -> tuple[list[Image.Image], int]:
+        """
+        Returns the tiles of the nth frame and the index of the frame they are actually from.
+        If the nth frame is not available these are the last decoded tiles, or transparent tiles with the index None.
+        """
         n = min(n, self.n_frames - 1)
-        tiles = None
         with self.lock:
+            # Check if the frame is already stored
+            if self.frame_store is not None:
+                stored_tiles = self.frame_store.get_tiles(n)
+                if stored_tiles is not None:
+                    self.slide_window(n)
+                    return stored_tiles, n
+
+            # Otherwise, decode it - frames decoded for other decks are stored as well through on_frame_decoded
+            if self.decoder is not None:
+                frame, frame_index = self.decoder.get_indexed_frame(n)
+                if frame is not None:
+                    tiles = self.frame_store.get_tiles(frame_index) if self.frame_store is not None else None
+                    if tiles is None:
+                        # Fit the frame to the deck and cut out all tiles in one go
+                        tiles = self.tiler.tile_array_to_images(self.tiler.get_rgb_tile_array(frame))
+                    self.last_tiles = tiles
+                    self.last_tiles_index = frame_index
+
             if self.is_cache_complete():
-                self.cap.release()
-                return self.cache.get(n, None)
-            
-            # Otherwise, continue with video capture
-            # Check if the frame is already decoded
-            if n in self.cache:
-                return self.cache[n]
-            
-            # If the requested frame is before the last decoded one, reset the capture
-            if n < self.last_frame_index:
-                self.cap.set(cv2.CAP_PROP_POS_FRAMES, n)
-                self.last_frame_index = n - 1
-
-            # Decode frames until the nth frame
-            while self.last_frame_index < n:
-                success, frame = self.cap.read()
-                if not success:
-                    break  # Reached the end of the video
-                self.last_frame_index += 1
-                
-                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)  
-                pil_image = Image.fromarray(frame_rgb)
-
-                # Resize the image
-                full_sized = self.create_full_deck_sized_image(pil_image)
-
-                tiles: list[Image.Image] = []
-                for key in range(self.key_count):
-                    current_tiles = self.crop_key_image_from_deck_sized_image(full_sized, key)
-                    tiles.append(current_tiles)
-
-                    if n >= self.n_frames - 1:
-                        if not self.is_cache_complete():
-                            self.save_cache_threaded()
-
-                if self.do_caching:
-                    self.cache[self.last_frame_index] = tiles
-                self.last_tiles = tiles
-                
-
-                full_sized.close()
-                pil_image.close()
+                log.info("Cache is complete. Releasing the video decoder.")
+                self.release_decoder()
 
+            self.slide_window(n)
 
         # Return the last decoded frame if the nth frame is not available
         if len(self.last_tiles) > 0:
-            tiles = self.last_tiles
-        if tiles is None:
-            tiles = [self.deck_controller.generate_alpha_key() for _ in range(self.deck_controller.deck.key_count())]
-        return self.cache.get(n, tiles)
-    
-    def create_full_deck_sized_image(self, frame: Image.Image) -> Image.Image:
-        key_width *= self.key_layout[0]
-        key_height *= self.key_layout[1]
-
-        # Compute the total number of extra non-visible pixels that are obscured by
-        # the bezel of the StreamDeck.
-        spacing_x *= self.key_layout[0] - 1
-        spacing_y *= self.key_layout[1] - 1
-
-        # Compute final full deck image size, based on the number of buttons and
-        # obscured pixels.
-        full_deck_image_size = (key_width + spacing_x, key_height + spacing_y)
-
-        # Resize the image to suit the StreamDeck's full image size. We use the
-        # helper function in Pillow's ImageOps module so that the image's aspect
-        # ratio is preserved.
-        return ImageOps.fit(frame, full_deck_image_size, Image.Resampling.HAMMING)
+            return self.last_tiles, self.last_tiles_index
+        return [self.deck_controller.generate_alpha_key() for _ in range(self.deck_controller.deck.key_count())], None
     
-    def crop_key_image_from_deck_sized_image(self, image: Image.Image, key):
-        # deck = self.deck_controller.deck
-        key_rows, key_cols = self.key_layout
-        key_width, key_height = self.key_size
-        spacing_x, spacing_y = self.spacing
-
-        # Determine which row and column the requested key is located on.
-        row = key // key_cols
-        col = key % key_cols
-
-        # Compute the starting X and Y offsets into the full size image that the
-        # requested key should display.
-        start_x = col * (key_width + spacing_x)
-        start_y = row * (key_height + spacing_y)
-
-        # Compute the region of the larger deck image that is occupied by the given
-        # key, and crop out that segment of the full image.
-        region = (start_x, start_y, start_x + key_width, start_y + key_height)
-        segment = image.crop(region)
-
-        # Create a new key-sized image, and paste in the cropped section of the
-        # larger image.
-
-        return segment
-
-    def get_video_hash(self) -> str:
-        sha1sum = hashlib.md5()
-        with open(self.video_path, 'rb') as video:
-            block = video.read(2**16)
-            while len(block) != 0:
-                sha1sum.update(block)
-                block = video.read(2**16)
-            return sha1sum.hexdigest()
-        
-    def save_cache_threaded(self):
-        t = threading.Thread(target=self.save_cache, name="save_video_cache")
-        t.start()
-        
-    @log.catch
-    def save_cache(self):
+    def slide_window(self, n: int) -> None:
         """
-        Store cache using pickle
+        Keeps the frames [n, n + resident_frames) in memory if the video doesn't fit into the budget.
+        In a loop the frames that were just shown are needed last again, so they get evicted.
         """
-        if self.cache_stored:
+        if self.resident_frames is None or self.frame_store is None or self.n_frames <= 0:
             return
-        self.cache_stored = True
-        
-        start = time.time()
-        cache_path = os.path.join(VID_CACHE, self.key_layout_str, f"{self.video_md5}.cache")
-        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
 
-        data = self.cache.copy()
+        previous = self.window_start
+        self.window_start = n
+        if previous is None:
+            return
 
-        with bz2.open(cache_path, "wb") as f:
-            pickle.dump(data, f)
+        for i in range((n - previous) % self.n_frames):
+            self.frame_store.evict_frame((previous + i) % self.n_frames)
+        self.frame_store.prefetch_frame((n + self.resident_frames - 1) % self.n_frames)
 
-        log.success(f"Saved cache in {time.time() - start:.2f} seconds")
-        self.last_save = time.time()
-        del data
+    def needs_frame(self, n: int) -> bool:
+        return self.frame_store is not None and not self.frame_store.has_frame(n)
 
+    def on_frame_decoded(self, n: int, frame) -> None:
+        """
+        Called by the shared decoder for every decoded frame this deck still needs
+        """
+        self.frame_store.write_frame(n, self.tiler.get_rgb_tile_array(frame))
 
-    @log.catch
-    def load_cache(self, key_index: int = None):
-        cache_path = os.path.join(VID_CACHE, self.key_layout_str, f"{self.video_md5}.cache")
-        if not os.path.exists(cache_path):
-            return
-        
-        # with open(os.path.join(VID_CACHE, "3x5", f"{self.video_md5}.pkl"), "rb") as f:
-            # self.cache = pickle.load(f)
-        
-        # return
-        _time = time.time()
-        try:
-            with ibz2.open(cache_path, parallelization=os.cpu_count()) as f:
-                self.cache = pickle.load(f)
-            log.success(f"Loaded cache in {time.time() - _time:.2f} seconds")
-        except Exception as e:
-            os.remove(cache_path)
-            log.error(f"Failed to load cache: {e}")
+    def release_decoder(self) -> None:
+        if self.decoder is None:
             return
+        video_decode_broker.release(self.decoder, self)
+        self.decoder = None
+
+    def get_native_tile(self, n: int, key_index: int) -> bytes:
+        return self.native_tile_cache.get(n, key_index)
+
+    def set_native_tile(self, n: int, key_index: int, native_image: bytes) -> None:
+        self.native_tile_cache.set(n, key_index, native_image)
+
+    def get_frame_store_path(self) -> str:
+        return os.path.join(VID_CACHE, self.key_layout_str, f"{self.video_md5}-{self.key_size[0]}x{self.key_size[1]}.frames")
+
+    def remove_legacy_cache(self) -> None:
+        """
+        Removes the bz2 compressed pickle cache of older versions
+        """
+        legacy_path = os.path.join(VID_CACHE, self.key_layout_str, f"{self.video_md5}.cache")
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+            log.info(f"Removed legacy video cache: {legacy_path}")
 
     def is_cache_complete(self) -> bool:
-        if self.n_frames != len(self.cache):
-            return False
-        
-        for key in self.cache:
-            if len(self.cache[key]) != self.key_count:
-                return False
-
-        return True
+        return self.frame_store is not None and self.frame_store.is_complete()
+
+    def release_budget(self) -> None:
+        """
+        Gives the reserved memory back, e.g. to the video replacing this one. Frames still work, they just can't be counted on to stay resident.
+        """
+        video_cache_budget.release(self.deck_serial, id(self))
     
     def close(self) -> None:
         import gc
         with self.lock:
-            self.cap.release()
-
-        for n in self.cache:
-            for f in self.cache[n]:
-                # ref = gc.get_referrers(f)
-                # if len(ref) > 1:
-                    # 
-                f.close()
-                f = None
+            self.release_decoder()
 
+        for tile in self.last_tiles:
+            tile.close()
+        self.last_tiles = []
 
-        self.cache = None
-        del self.cache
-        del self.cap
+        if self.frame_store is not None:
+            self.frame_store.close()
+        self.release_budget()
+        self.native_tile_cache.save_threaded()
         gc.collect()
-        del self
\ No newline at end of file
+        del self
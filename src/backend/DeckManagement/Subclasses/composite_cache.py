@@ -0,0 +1,72 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from PIL import Image
+
+@dataclass
+class CompositeCacheEntry:
+    image: Image.Image
+    native_image: bytes
+
+
+class CompositeCache:
+    """
+    Bounded LRU cache of the final composed key images and their native representation.
+    The keys are fingerprints of all layers that make up a key image, see ControllerKey.get_image_fingerprint
+    """
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max(0, max_entries)
+        self.entries: OrderedDict[tuple, CompositeCacheEntry] = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get(self, fingerprint: tuple) -> CompositeCacheEntry:
+        with self.lock:
+            entry = self.entries.get(fingerprint)
+            if entry is None:
+                self.misses += 1
+                return
+            self.entries.move_to_end(fingerprint)
+            self.hits += 1
+            return entry
+
+    def put(self, fingerprint: tuple, image: Image.Image, native_image: bytes) -> None:
+        if self.max_entries == 0:
+            return
+        with self.lock:
+            self.entries[fingerprint] = CompositeCacheEntry(image=image, native_image=native_image)
+            self.entries.move_to_end(fingerprint)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def set_max_entries(self, max_entries: int) -> None:
+        with self.lock:
+            self.max_entries = max(0, max_entries)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+
+    def get_hit_rate(self) -> float:
+        total = self.hits + self.misses
+        if total == 0:
+            return 0
+        return self.hits / total
@@ -0,0 +1,91 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import threading
+from collections import OrderedDict
+from PIL import ImageFont
+import matplotlib.font_manager
+from loguru import logger as log
+
+class FontRegistry:
+    """
+    Process wide cache of loaded fonts.
+    Font paths are resolved once per family and the parsed FreeTypeFonts are kept per (family, size) with LRU eviction.
+    The fonts are shared by all threads but FreeType faces are not thread safe, so measuring or drawing text with them
+    has to hold render_lock.
+    """
+    def __init__(self, max_fonts: int = 64):
+        self.max_fonts = max_fonts
+        self.lock = threading.Lock()
+        self.render_lock = threading.RLock()
+
+        self.font_paths: dict[str, str] = {}
+        self.fonts: OrderedDict[tuple[str, int], ImageFont.FreeTypeFont] = OrderedDict()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get_font_path(self, family: str) -> str:
+        family = family or ""
+        with self.lock:
+            path = self.font_paths.get(family)
+        if path is not None:
+            return path
+
+        path = matplotlib.font_manager.findfont(matplotlib.font_manager.FontProperties(family=family))
+        with self.lock:
+            self.font_paths[family] = path
+        return path
+
+    def get_font(self, family: str, size: int) -> ImageFont.FreeTypeFont:
+        family = family or ""
+        key = (family, size)
+        with self.lock:
+            font = self.fonts.get(key)
+            if font is not None:
+                self.fonts.move_to_end(key)
+                self.hits += 1
+                return font
+            self.misses += 1
+
+        font = ImageFont.truetype(self.get_font_path(family), size)
+
+        with self.lock:
+            self.fonts[key] = font
+            self.fonts.move_to_end(key)
+            while len(self.fonts) > self.max_fonts:
+                self.fonts.popitem(last=False)
+        return font
+
+    def warm_up(self, fonts: set[tuple[str, int]]) -> None:
+        """
+        Loads all given (family, size) fonts so that the first render doesn't have to
+        """
+        for family, size in fonts:
+            try:
+                self.get_font(family, size)
+            except OSError as e:
+                log.error(f"Failed to load font {family} in size {size}. Error: {e}")
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "loaded-fonts": len(self.fonts),
+                "resolved-families": len(self.font_paths)
+            }
+
+
+font_registry = FontRegistry()
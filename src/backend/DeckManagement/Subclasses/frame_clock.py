@@ -0,0 +1,122 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import bisect
+import itertools
+import time
+
+NS_PER_SECOND = 1_000_000_000
+
+class FrameClock:
+    """
+    Presentation clock of a video or gif based on time.monotonic_ns.
+    The frame to show is derived from the time since playback started and the presentation timestamps of the frames,
+    so playback keeps its speed no matter how often it is polled - frames that are due at the same time get dropped.
+    """
+    def __init__(self, n_frames: int, fps: float = None, frame_durations_ms: list[float] = None, loop: bool = True, max_fps: float = 30):
+        """
+        Args:
+            n_frames (int): Number of frames
+            fps (float): Frame rate of the video, used if frame_durations_ms is not given. Falls back to 30 if unknown.
+            frame_durations_ms (list[float]): Duration of each frame, e.g. of gifs
+            loop (bool): Whether playback starts over after the last frame
+            max_fps (float): Maximum rate at which new frames get presented, frames in between are dropped
+        """
+        self.n_frames = max(1, n_frames)
+        self.loop = loop
+
+        if frame_durations_ms:
+            # Browsers treat very short gif frame durations as 100 ms, so do we
+            durations_ns = [int((d if d and d > 10 else 100) * 1_000_000) for d in frame_durations_ms[:self.n_frames]]
+        else:
+            if not fps or fps <= 0:
+                fps = 30
+            durations_ns = [int(NS_PER_SECOND / fps)] * self.n_frames
+        # Start of each frame relative to the start of the video
+        self.timestamps_ns: list[int] = [0, *itertools.accumulate(durations_ns)][:self.n_frames]
+        self.duration_ns: int = sum(durations_ns)
+
+        self.set_max_fps(max_fps)
+
+        self.start_ns: int = None
+        # Time at which the next frame has to be presented, None once a video without loop reached its end
+        self.next_deadline_ns: int = None
+
+    def set_max_fps(self, max_fps: float) -> None:
+        self.min_interval_ns = int(NS_PER_SECOND / max_fps) if max_fps and max_fps > 0 else 0
+
+    def set_loop(self, loop: bool) -> None:
+        """
+        Changes whether playback starts over without restarting the current playback
+        """
+        self.loop = loop
+        if loop and self.start_ns is not None and self.next_deadline_ns is None:
+            # Playback had reached the end, continue right away
+            self.next_deadline_ns = time.monotonic_ns()
+
+    def start(self, now_ns: int = None) -> None:
+        self.start_ns = time.monotonic_ns() if now_ns is None else now_ns
+        self.next_deadline_ns = self.start_ns
+
+    def get_frame_index(self, now_ns: int = None) -> int:
+        """
+        Returns the index of the frame that has to be shown at the given time
+        """
+        if now_ns is None:
+            now_ns = time.monotonic_ns()
+        if self.start_ns is None:
+            self.start(now_ns)
+
+        elapsed = now_ns - self.start_ns
+        if elapsed >= self.duration_ns:
+            if not self.loop or self.duration_ns <= 0:
+                return self.n_frames - 1
+            elapsed %= self.duration_ns
+        return max(0, bisect.bisect_right(self.timestamps_ns, elapsed) - 1)
+
+    def get_next_frame_time(self, now_ns: int) -> int:
+        """
+        Returns the time at which the frame following the one shown at now_ns starts, None if there is none
+        """
+        elapsed = now_ns - self.start_ns
+        cycle_start = self.start_ns
+        if elapsed >= self.duration_ns:
+            if not self.loop or self.duration_ns <= 0:
+                return
+            cycle_start += elapsed // self.duration_ns * self.duration_ns
+
+        index = self.get_frame_index(now_ns)
+        if index + 1 < self.n_frames:
+            return cycle_start + self.timestamps_ns[index + 1]
+        if not self.loop:
+            return
+        # The next frame is the first one of the next cycle
+        return cycle_start + self.duration_ns
+
+    def poll(self, now_ns: int) -> bool:
+        """
+        Returns True if a new frame is due and schedules the next deadline.
+        The deadline is at least min_interval_ns away, so fast videos get presented at max_fps and drop the frames in between.
+        """
+        if self.start_ns is None:
+            self.start(now_ns)
+        if self.next_deadline_ns is None or now_ns < self.next_deadline_ns:
+            return False
+
+        next_frame_time = self.get_next_frame_time(now_ns)
+        if next_frame_time is None:
+            self.next_deadline_ns = None
+        else:
+            self.next_deadline_ns = max(next_frame_time, now_ns + self.min_interval_ns)
+        return True
@@ -0,0 +1,160 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import threading
+import weakref
+from collections import deque
+from typing import Any, Callable
+from loguru import logger as log
+
+class FramePrefetcher:
+    """
+    Decodes the frames of a video ahead of time on its own thread.
+    The decoder fills a bounded ring buffer with the frames following the last requested one, so the media
+    thread only has to dequeue them. Requesting a frame that isn't buffered (a seek) restarts decoding after it.
+    The last returned frame is kept, so rendering the same frame again doesn't count as a seek.
+    """
+    def __init__(self, produce: Callable[[int], Any], n_frames: int, loop: bool = True, depth: int = 8, start: int = 0, name: str = "frame_prefetcher"):
+        """
+        Args:
+            produce (Callable[[int], Any]): Returns the ready to use frame with the given index, called on the decoder thread
+            n_frames (int): Number of frames of the video
+            loop (bool): Whether decoding wraps around to the first frame after the last one
+            depth (int): Maximum number of buffered frames
+            start (int): Index of the first frame to decode
+        """
+        self.produce = produce
+        self.n_frames = n_frames
+        self.loop = loop
+        self.depth = max(1, depth)
+
+        self.condition = threading.Condition()
+        self.produce_lock = threading.Lock()
+        self.buffer: deque[tuple[int, Any]] = deque()
+        self.next_index: int = start
+        # Incremented on every seek, frames decoded for an older generation are dropped
+        self.generation: int = 0
+        self.stop_event = threading.Event()
+
+        # The frame returned last, requests for it are served again without touching the buffer
+        self.last_index: int = None
+        self.last_frame: Any = None
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+        # The thread only holds a weak reference, so an unused prefetcher gets collected even if it wasn't closed
+        self.thread = threading.Thread(target=FramePrefetcher._run, args=(weakref.ref(self), self.condition, self.stop_event),
+                                       name=name, daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _run(prefetcher_ref: "weakref.ref[FramePrefetcher]", condition: threading.Condition, stop_event: threading.Event) -> None:
+        while not stop_event.is_set():
+            prefetcher = prefetcher_ref()
+            if prefetcher is None:
+                return
+
+            with condition:
+                if not prefetcher.needs_frame():
+                    del prefetcher
+                    # Wake up from time to time to notice if the prefetcher got garbage collected
+                    condition.wait(timeout=1)
+                    continue
+                index = prefetcher.next_index
+                generation = prefetcher.generation
+
+            prefetcher.produce_frame(index, generation)
+            del prefetcher
+
+    def needs_frame(self) -> bool:
+        if len(self.buffer) >= self.depth:
+            return False
+        return 0 <= self.next_index < self.n_frames
+
+    def get_following_index(self, n: int) -> int:
+        n += 1
+        if n >= self.n_frames and self.loop:
+            return 0
+        return n
+
+    def produce_frame(self, index: int, generation: int) -> None:
+        try:
+            with self.produce_lock:
+                if self.stop_event.is_set():
+                    return
+                frame = self.produce(index)
+        except Exception as e:
+            log.error(f"Failed to prefetch frame {index}: {e}")
+            frame = None
+
+        with self.condition:
+            if generation != self.generation or self.stop_event.is_set():
+                return
+            self.buffer.append((index, frame))
+            self.next_index = self.get_following_index(index)
+
+    def get(self, n: int) -> Any:
+        """
+        Returns the frame with the given index. It is taken from the buffer if it has been decoded already, otherwise
+        it is decoded right away and the decoder continues after it.
+        """
+        with self.condition:
+            if n == self.last_index:
+                self.hits += 1
+                return self.last_frame
+
+            if any(index == n for index, _ in self.buffer):
+                # Frames before n got skipped, e.g. because the video plays faster than it gets shown
+                while True:
+                    index, frame = self.buffer.popleft()
+                    if index == n:
+                        break
+                self.hits += 1
+                self.last_index, self.last_frame = n, frame
+                self.condition.notify_all()
+                return frame
+
+            # Not buffered - seek
+            self.misses += 1
+            self.buffer.clear()
+            self.generation += 1
+            self.next_index = self.get_following_index(n)
+            generation = self.generation
+            self.condition.notify_all()
+
+        with self.produce_lock:
+            frame = self.produce(n)
+
+        with self.condition:
+            # Another seek might have happened in the meantime
+            if generation == self.generation:
+                self.last_index, self.last_frame = n, frame
+        return frame
+
+    def get_hit_rate(self) -> float:
+        total = self.hits + self.misses
+        if total == 0:
+            return 0
+        return self.hits / total
+
+    def close(self) -> None:
+        self.stop_event.set()
+        with self.condition:
+            self.buffer.clear()
+            self.last_index = None
+            self.last_frame = None
+            self.condition.notify_all()
+        if threading.current_thread() is not self.thread:
+            self.thread.join(timeout=2)
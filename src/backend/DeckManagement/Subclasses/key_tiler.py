@@ -0,0 +1,177 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import time
+import numpy as np
+import cv2
+from PIL import Image, ImageOps
+
+class KeyTiler:
+    """
+    Cuts full deck sized frames into key tiles.
+    The frame is fitted with cv2 and all tiles are sliced out of it with a single strided NumPy view.
+    """
+    def __init__(self, key_layout: tuple[int, int], key_size: tuple[int, int], spacing: tuple[int, int] = (36, 36)):
+        """
+        Args:
+            key_layout (tuple[int, int]): (rows, cols) of the deck, like returned by deck.key_layout()
+            key_size (tuple[int, int]): (width, height) of one key
+            spacing (tuple[int, int]): Pixels hidden by the bezel between two keys
+        """
+        self.rows, self.cols = key_layout
+        self.key_width, self.key_height = key_size
+        self.spacing_x, self.spacing_y = spacing
+
+        # Size of the whole deck including the pixels hidden by the bezel
+        self.full_size = (
+            self.key_width * self.cols + self.spacing_x * (self.cols - 1),
+            self.key_height * self.rows + self.spacing_y * (self.rows - 1)
+        )
+
+    def fit(self, frame: np.ndarray, interpolation: int = cv2.INTER_AREA) -> np.ndarray:
+        """
+        Crops the frame to the aspect ratio of the deck and resizes it to the full deck size - like ImageOps.fit
+        """
+        height, width = frame.shape[:2]
+        target_width, target_height = self.full_size
+
+        target_ratio = target_width / target_height
+        if width / height > target_ratio:
+            # Frame is too wide
+            crop_width = max(1, round(height * target_ratio))
+            x = (width - crop_width) // 2
+            frame = frame[:, x:x + crop_width]
+        else:
+            # Frame is too high
+            crop_height = max(1, round(width / target_ratio))
+            y = (height - crop_height) // 2
+            frame = frame[y:y + crop_height]
+
+        return cv2.resize(frame, self.full_size, interpolation=interpolation)
+
+    def get_tile_array(self, full_sized: np.ndarray) -> np.ndarray:
+        """
+        Returns all tiles of a full deck sized frame as one contiguous (rows, cols, height, width, channels) array
+        """
+        stride_y, stride_x, stride_c = full_sized.strides
+        view = np.lib.stride_tricks.as_strided(
+            full_sized,
+            shape=(self.rows, self.cols, self.key_height, self.key_width, full_sized.shape[2]),
+            strides=(
+                stride_y * (self.key_height + self.spacing_y),
+                stride_x * (self.key_width + self.spacing_x),
+                stride_y,
+                stride_x,
+                stride_c
+            ),
+            writeable=False
+        )
+        return np.ascontiguousarray(view)
+
+    def get_rgb_tile_array(self, frame: np.ndarray, bgr: bool = True, interpolation: int = cv2.INTER_AREA) -> np.ndarray:
+        """
+        Fits a decoded frame (like returned by cv2.VideoCapture.read) to the deck and returns its RGB tiles
+        as one contiguous (rows, cols, height, width, 3) array
+
+        Args:
+            frame (np.ndarray): The frame
+            bgr (bool): Whether the frame is in cv2's BGR order
+            interpolation (int): cv2 interpolation used to resize the frame
+        """
+        full_sized = self.fit(frame, interpolation=interpolation)
+        if full_sized.ndim == 2:
+            full_sized = cv2.cvtColor(full_sized, cv2.COLOR_GRAY2RGB)
+        elif bgr:
+            full_sized = cv2.cvtColor(full_sized, cv2.COLOR_BGR2RGB)
+
+        return self.get_tile_array(full_sized)
+
+    def tile_array_to_images(self, tiles: np.ndarray) -> list[Image.Image]:
+        """
+        Wraps the tiles of a tile array into one RGB image per key without copying them
+        """
+        size = (self.key_width, self.key_height)
+        return [Image.frombuffer("RGB", size, tiles[row, col], "raw", "RGB", 0, 1)
+                for row in range(self.rows) for col in range(self.cols)]
+
+    def get_tiles_from_array(self, frame: np.ndarray, bgr: bool = True, interpolation: int = cv2.INTER_AREA) -> list[Image.Image]:
+        """
+        Tiles a decoded frame (like returned by cv2.VideoCapture.read) into one RGB image per key
+
+        Args:
+            frame (np.ndarray): The frame
+            bgr (bool): Whether the frame is in cv2's BGR order
+            interpolation (int): cv2 interpolation used to resize the frame
+        """
+        tiles = self.get_rgb_tile_array(frame, bgr=bgr, interpolation=interpolation)
+        return self.tile_array_to_images(tiles)
+
+    def get_tiles_from_image(self, image: Image.Image, interpolation: int = cv2.INTER_AREA) -> list[Image.Image]:
+        """
+        Tiles a PIL image into one RGB image per key
+        """
+        frame = np.asarray(image.convert("RGB"))
+        return self.get_tiles_from_array(frame, bgr=False, interpolation=interpolation)
+
+
+def _pil_get_tiles(frame: np.ndarray, key_layout: tuple[int, int], key_size: tuple[int, int], spacing: tuple[int, int] = (36, 36)) -> list[Image.Image]:
+    """
+    The previous PIL based implementation - only used by the benchmark
+    """
+    rows, cols = key_layout
+    key_width, key_height = key_size
+    spacing_x, spacing_y = spacing
+    full_size = (key_width * cols + spacing_x * (cols - 1), key_height * rows + spacing_y * (rows - 1))
+
+    pil_image = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    full_sized = ImageOps.fit(pil_image, full_size, Image.Resampling.HAMMING)
+
+    tiles = []
+    for key in range(rows * cols):
+        row = key // cols
+        col = key % cols
+        start_x = col * (key_width + spacing_x)
+        start_y = row * (key_height + spacing_y)
+        segment = full_sized.crop((start_x, start_y, start_x + key_width, start_y + key_height))
+        key_image = Image.new("RGB", key_size)
+        key_image.paste(segment)
+        tiles.append(key_image)
+    return tiles
+
+
+def benchmark(n_runs: int = 50, frame_size: tuple[int, int] = (1920, 1080)) -> None:
+    """
+    Compares the PIL tiling with the KeyTiler for the 15 and 32 key layouts
+    Run with: python -m src.backend.DeckManagement.Subclasses.key_tiler
+    """
+    frame = np.random.randint(0, 255, (frame_size[1], frame_size[0], 3), dtype=np.uint8)
+
+    for name, key_layout, key_size in [("15 keys", (3, 5), (72, 72)), ("32 keys", (4, 8), (96, 96))]:
+        tiler = KeyTiler(key_layout, key_size)
+
+        start = time.perf_counter()
+        for _ in range(n_runs):
+            _pil_get_tiles(frame, key_layout, key_size)
+        pil_time = (time.perf_counter() - start) / n_runs
+
+        start = time.perf_counter()
+        for _ in range(n_runs):
+            tiler.get_tiles_from_array(frame)
+        numpy_time = (time.perf_counter() - start) / n_runs
+
+        print(f"{name}: PIL {pil_time * 1000:.2f} ms, KeyTiler {numpy_time * 1000:.2f} ms per frame ({pil_time / numpy_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -13,37 +13,76 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
-from functools import lru_cache
-import hashlib
 import os
-import sys
+import shutil
 import threading
 import time
+import weakref
+import numpy as np
 from PIL import Image, ImageOps
 import cv2
 from loguru import logger as log
 import globals as gl
+from src.backend.DeckManagement.Subclasses.raw_frame_store import RawFrameStore, prune_frame_stores_threaded, remove_stale_stores
+from src.backend.DeckManagement.Subclasses.video_cache_budget import video_cache_budget
+from src.backend.DeckManagement.Subclasses.video_decode_broker import video_decode_broker
 
-VID_CACHE = "vid_cache"
+VID_CACHE = os.path.join(gl.DATA_PATH, "cache", "videos", "single_key")
+# The disk limit is shared with the frame stores of the background videos
+FRAME_STORE_ROOT = os.path.dirname(VID_CACHE)
+# Per frame jpg directories of older versions, relative to the working directory
+LEGACY_VID_CACHE = "vid_cache"
+LEGACY_FRAME_SIZE = (72, 72)
 
 class VideoFrameCache:
-    def __init__(self, video_path):
+    def __init__(self, video_path, deck_serial: str = None, frame_size: tuple[int, int] = (72, 72)):
+        """
+        Args:
+            frame_size (tuple[int, int]): Size the frames get stored in, should be the size they get shown in
+        """
         self.lock = threading.Lock()
 
         self.video_path = video_path
         self.cap = cv2.VideoCapture(video_path)
         self.n_frames = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.cache = {}
+        self.native_fps: float = self.cap.get(cv2.CAP_PROP_FPS)
         self.last_decoded_frame = None
         self.last_frame_index = -1
 
         self.video_md5 = self.get_video_hash()
 
-        self.frame_width: int = 72
+        self.frame_size: tuple[int, int] = tuple(frame_size)
+        self.deck_serial = deck_serial
+
+        # Decoded frames are written into one memory mapped file per video, frames are only read when they are shown
+        self.frame_store: RawFrameStore = None
 
-        self.load_cache()
+        performance_settings = gl.settings_manager.get_app_settings().get("performance", {})
+        self.do_caching = performance_settings.get("cache-videos", True)
 
-        self.do_caching = gl.settings_manager.get_app_settings().get("performance", {}).get("cache-videos", True)
+        if self.do_caching:
+            # Only keep the frames in memory if the whole video fits into the budget, stream it otherwise
+            video_cache_budget.load_limits_from_settings(performance_settings)
+            video_bytes = self.n_frames * self.frame_size[0] * self.frame_size[1] * RawFrameStore.CHANNELS
+            if video_cache_budget.reserve(deck_serial, id(self), video_bytes) < video_bytes:
+                video_cache_budget.release(deck_serial, id(self))
+                self.do_caching = False
+                log.info(f"Video cache budget exceeded, streaming {video_path}")
+            else:
+                weakref.finalize(self, video_cache_budget.release, deck_serial, id(self))
+
+        if self.do_caching:
+            self.frame_store = RawFrameStore(
+                path=self.get_frame_store_path(),
+                n_frames=self.n_frames,
+                key_count=1,
+                key_size=self.frame_size
+            )
+            self.migrate_legacy_cache()
+            # Frames of sizes that haven't been shown for a long time are outdated, the size changed
+            remove_stale_stores(self.frame_store.path, f"{self.video_md5}-")
+            # Keep the frame stores of all videos within their disk limit
+            prune_frame_stores_threaded(FRAME_STORE_ROOT, int(performance_settings.get("video-frame-cache-mb", 4096) * 1024 * 1024))
 
 
         if self.is_cache_complete():
@@ -52,108 +91,116 @@ class VideoFrameCache:
         else:
             log.info("Cache is not complete. Continuing with video capture.")
 
-        # Print size of cache in memory in mb:
-        log.trace(f"Size of cache in memory: {sys.getsizeof(self.cache) / 1024 / 1024:.2f} MB")
-
-        log.trace(f"Size of capture: {sys.getsizeof(self.cap) / 1024 / 1024:.2f} MB")
-
     def get_frame(self, n):
         n = min(n, self.n_frames - 1)
-        if self.is_cache_complete():
-            return self.cache.get(n, None)
+        frame = self.get_stored_frame(n)
+        if frame is not None:
+            return frame
 
         # Otherwise, continue with video capture
-        # Check if the frame is already decoded
-        if n in self.cache:
-            return self.cache[n]
+        with self.lock:
+            if self.cap is None:
+                return self.last_decoded_frame
 
-        # If the requested frame is before the last decoded one, reset the capture
-        if n < self.last_frame_index:
-            with self.lock:
+            # If the requested frame is before the last decoded one, reset the capture
+            if n < self.last_frame_index:
                 self.cap.set(cv2.CAP_PROP_POS_FRAMES, n)
-            self.last_frame_index = n - 1
+                self.last_frame_index = n - 1
 
-        # Decode frames until the nth frame
-        while self.last_frame_index < n:
-            with self.lock:
+            # Decode frames until the nth frame
+            while self.last_frame_index < n:
                 success, frame = self.cap.read()
-            if not success:
-                break  # Reached the end of the video
-            self.last_frame_index += 1
-            
-            # Calculate the new height to maintain aspect ratio
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(frame_rgb)
+                if not success:
+                    break  # Reached the end of the video
+                self.last_frame_index += 1
+                
+                # Calculate the new height to maintain aspect ratio
+                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                pil_image = Image.fromarray(frame_rgb)
+
+                # Fill the frame size completely with the image, keeping the aspect ratio
+                pil_image = ImageOps.fit(pil_image, self.frame_size, Image.Resampling.LANCZOS)
 
-            # Fill a 72x72 square completely with the image, keeping the aspect ratio
-            pil_image = ImageOps.fit(pil_image, (self.frame_width, self.frame_width), Image.Resampling.LANCZOS)
+                self.last_decoded_frame = pil_image
 
-            self.last_decoded_frame = pil_image
-            if self.do_caching:
-                self.cache[self.last_frame_index] = pil_image
+                # Write the frame to the cache
+                self.write_cache(pil_image, self.last_frame_index)
 
-            # Write the frame to the cache
-            self.write_cache(pil_image, self.last_frame_index)
+        if self.is_cache_complete():
+            log.info("Cache is complete. Closing the video capture.")
+            self.release()
 
         # Return the last decoded frame if the nth frame is not available
-        return self.cache.get(n, self.last_decoded_frame)
+        frame = self.get_stored_frame(n)
+        if frame is not None:
+            return frame
+        return self.last_decoded_frame
+
+    def get_stored_frame(self, n: int) -> Image.Image:
+        if self.frame_store is None:
+            return
+        tiles = self.frame_store.get_tiles(n)
+        if tiles is None:
+            return
+        return tiles[0]
 
     def release(self):
         with self.lock:
-            self.cap.release()
+            if self.cap is not None:
+                self.cap.release()
+            self.cap = None
+
+    def close(self) -> None:
+        self.release()
+        self.last_decoded_frame = None
+        if self.frame_store is not None:
+            self.frame_store.close()
+        # Don't wait for the garbage collector, other videos might need the budget right away
+        video_cache_budget.release(self.deck_serial, id(self))
 
     def get_video_hash(self) -> str:
-        with self.lock:
-            sha1sum = hashlib.md5()
-            with open(self.video_path, 'rb') as video:
-                block = video.read(2**16)
-                while len(block) != 0:
-                    sha1sum.update(block)
-                    block = video.read(2**16)
-                return sha1sum.hexdigest()
-
-    def write_cache(self, image: Image, frame_index: int, key_index: int = None):
-        """
-        key_index: if None: single key video, if int: key index
-        """
-        with self.lock:
-            if key_index is None:
-                path = os.path.join(VID_CACHE, "single_key", self.video_md5, f"{frame_index}.jpg")
-            else:
-                path = os.path.join(VID_CACHE, f"key: {key_index}", self.video_md5, f"{key_index}", f"{frame_index}.jpg")
+        return video_decode_broker.get_video_hash(self.video_path)
 
-            if os.path.isfile(path):
-                return
-            
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            
-            image.save(path)
+    def get_frame_store_path(self) -> str:
+        return os.path.join(VID_CACHE, f"{self.video_md5}-{self.frame_size[0]}x{self.frame_size[1]}.frames")
 
-    def load_cache(self, key_index: int = None):
-        with self.lock:
-            start = time.time()
-            if key_index is None:
-                path = os.path.join(VID_CACHE, "single_key", self.video_md5)
-                if not os.path.exists(path):
-                    return
-                for file in os.listdir(path):
-                    if os.path.splitext(file)[1] != ".jpg":
-                        continue
-                    with Image.open(os.path.join(path, file)) as img:
-                        self.cache[int(file.split(".")[0])] = img.copy()
+    def write_cache(self, image: Image, frame_index: int):
+        if self.frame_store is None:
+            return
+        if image.mode != "RGB" or image.size != self.frame_size:
+            image = ImageOps.fit(image.convert("RGB"), self.frame_size, Image.Resampling.LANCZOS)
+        self.frame_store.write_frame(frame_index, np.asarray(image))
+
+    def migrate_legacy_cache(self) -> None:
+        """
+        Moves the frames of the per frame jpg cache of older versions into the frame store and removes it.
+        The old frames are only used if they have the size of the store, upscaling them would look worse than decoding the video again.
+        """
+        legacy_path = os.path.join(LEGACY_VID_CACHE, "single_key", self.video_md5)
+        if not os.path.isdir(legacy_path):
+            return
+
+        start = time.time()
+        files = os.listdir(legacy_path) if self.frame_size == LEGACY_FRAME_SIZE else []
+        for file in files:
+            name, extension = os.path.splitext(file)
+            if extension != ".jpg" or not name.isdigit():
+                continue
+            if self.frame_store.has_frame(int(name)):
+                continue
+            try:
+                with Image.open(os.path.join(legacy_path, file)) as img:
+                    self.write_cache(img, int(name))
+            except OSError as e:
+                log.warning(f"Skipping broken legacy video cache frame {file}: {e}")
+
+        shutil.rmtree(legacy_path, ignore_errors=True)
+        try:
+            # Remove vid_cache/single_key and vid_cache once the last video got migrated
+            os.removedirs(os.path.dirname(legacy_path))
+        except OSError:
+            pass
+        log.info(f"Migrated legacy video cache {legacy_path} in {time.time() - start:.2f} seconds")
 
-            else:
-                path = os.path.join(VID_CACHE, f"key: {key_index}", self.video_md5)
-                if not os.path.exists(path):
-                    return
-                for file in os.listdir(path):
-                    if os.path.splitext(file)[1] != ".jpg":
-                        continue
-                    with Image.open(os.path.join(path, file)) as img:
-                        self.cache[int(file.split(".")[0])] = img.copy()
-
-            log.info(f"Loaded cache in {time.time() - start:.2f} seconds")
-
-    @lru_cache(maxsize=None)
     def is_cache_complete(self) -> bool:
-        return len(self.cache) == self.n_frames
+        return self.frame_store is not None and self.frame_store.is_complete()
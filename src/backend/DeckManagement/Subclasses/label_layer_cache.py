@@ -0,0 +1,93 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import threading
+from collections import OrderedDict
+from PIL import Image, ImageDraw
+
+from src.backend.DeckManagement.Subclasses.font_registry import font_registry
+
+# Import typing
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from src.backend.DeckManagement.Subclasses.KeyLabel import KeyLabel
+
+STROKE_WIDTH = 2
+STROKE_FILL = "black"
+
+class LabelLayerCache:
+    """
+    Process wide LRU cache of rendered labels.
+    Each distinct label is rendered once into a transparent key sized layer which only needs to be alpha composited afterwards.
+    """
+    def __init__(self, max_layers: int = 512):
+        self.max_layers = max_layers
+        self.lock = threading.Lock()
+        self.layers: OrderedDict[tuple, Image.Image] = OrderedDict()
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get_layer_key(self, label: "KeyLabel", position: str, size: tuple[int, int]) -> tuple:
+        return (label.text, label.font_name, label.font_size, tuple(label.color), STROKE_WIDTH, STROKE_FILL, position, tuple(size))
+
+    def get_layer(self, label: "KeyLabel", position: str, size: tuple[int, int]) -> Image.Image:
+        layer_key = self.get_layer_key(label, position, size)
+        with self.lock:
+            layer = self.layers.get(layer_key)
+            if layer is not None:
+                self.layers.move_to_end(layer_key)
+                self.hits += 1
+                return layer
+            self.misses += 1
+
+        layer = self.render_layer(label, position, size)
+
+        with self.lock:
+            self.layers[layer_key] = layer
+            self.layers.move_to_end(layer_key)
+            while len(self.layers) > self.max_layers:
+                self.layers.popitem(last=False)
+        return layer
+
+    def render_layer(self, label: "KeyLabel", position: str, size: tuple[int, int]) -> Image.Image:
+        layer = Image.new("RGBA", size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(layer)
+
+        font = font_registry.get_font(label.font_name, label.font_size)
+        # The font is shared with other threads
+        with font_registry.render_lock:
+            _, _, w, h = draw.textbbox((0, 0), label.text, font=font)
+
+            if position == "top":
+                xy = (layer.width / 2, h/2 + 3)
+            elif position == "bottom":
+                xy = (layer.width / 2, layer.height - h/2 - 3)
+            else:
+                xy = (layer.width / 2, layer.height / 2)
+
+            draw.text(xy,
+                      text=label.text, font=font, anchor="mm", align="center",
+                      fill=tuple(label.color), stroke_width=STROKE_WIDTH,
+                      stroke_fill=STROKE_FILL)
+
+        del draw
+        return layer
+
+    def clear(self) -> None:
+        with self.lock:
+            self.layers.clear()
+
+
+label_layer_cache = LabelLayerCache()
@@ -0,0 +1,268 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
+from loguru import logger as log
+
+from src.backend.DeckManagement.HelperMethods import is_image, is_svg, load_svg_as_pil
+
+# Import globals
+import globals as gl
+
+SCALED_CACHE = os.path.join(gl.DATA_PATH, "cache", "key_images")
+
+class MediaImageCache:
+    """
+    Process wide cache of decoded key media images.
+    Images are kept per (path, size, mtime) with LRU eviction, so changing the file on disk invalidates its entry.
+    Key sized versions are kept per (path, size, mtime, fill mode, scaled size) in memory and as png files in SCALED_CACHE,
+    so rendering a key neither has to decode the full resolution asset nor resample it.
+    The size and mtime of a file are only read again when a key image gets created for it, see refresh.
+    """
+    # The disk cache gets pruned after this many writes
+    PRUNE_INTERVAL = 64
+    MAX_STATS = 4096
+
+    def __init__(self, max_images: int = 256, max_scaled_images: int = 1024):
+        self.max_images = max_images
+        self.max_scaled_images = max_scaled_images
+        self.lock = threading.Lock()
+
+        self.images: OrderedDict[tuple[str, int, int], Image.Image] = OrderedDict()
+        self.scaled_images: OrderedDict[tuple, Image.Image] = OrderedDict()
+        # path -> cache key with the size and mtime of the file when it was last checked
+        self.cache_keys: dict[str, tuple[str, int, int]] = {}
+
+        # Scaled images are written to the disk in the background
+        self.disk_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="key_image_cache_writer")
+        self.n_disk_writes: int = 0
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.scaled_hits: int = 0
+        self.scaled_disk_hits: int = 0
+        self.scaled_misses: int = 0
+
+    def get_cache_key(self, path: str) -> tuple[str, int, int]:
+        """
+        Raises OSError if the file doesn't exist
+        """
+        key = self.cache_keys.get(path)
+        if key is not None:
+            return key
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            if len(self.cache_keys) >= self.MAX_STATS:
+                self.cache_keys.clear()
+            self.cache_keys[path] = key
+        return key
+
+    def refresh(self, paths: set[str]) -> None:
+        """
+        Reads the size and mtime of the files again on their next use, so changed files get loaded again
+        """
+        with self.lock:
+            for path in paths:
+                self.cache_keys.pop(path, None)
+
+    def get(self, path: str) -> Image.Image:
+        """
+        Returns a copy of the decoded image, the caller owns the copy and may close it
+
+        Returns:
+            Image.Image: The image or None if it can't be loaded
+        """
+        image = self.load(path)
+        if image is None:
+            return
+        return image.copy()
+
+    def load(self, path: str) -> Image.Image:
+        try:
+            key = self.get_cache_key(path)
+        except OSError:
+            return
+        with self.lock:
+            image = self.images.get(key)
+            if image is not None:
+                self.images.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+
+        try:
+            if is_svg(path):
+                image = load_svg_as_pil(path)
+            elif is_image(path):
+                with Image.open(path) as file:
+                    image = file.copy()
+            else:
+                return
+            # Decode now, PIL loads lazily
+            image.load()
+        except Exception as e:
+            log.error(f"Failed to load media {path}: {e}")
+            return
+
+        with self.lock:
+            self.images[key] = image
+            self.images.move_to_end(key)
+            while len(self.images) > self.max_images:
+                self.images.popitem(last=False)
+        return image
+
+    def get_scaled(self, path: str, fill_mode: str, size: tuple[int, int]) -> Image.Image:
+        """
+        Returns the image fitted into size using the fill mode ("stretch", "cover" or "contain") as RGBA.
+        The image is shared, callers must not modify or close it.
+
+        Returns:
+            Image.Image: The image or None if it can't be loaded
+        """
+        try:
+            key = (*self.get_cache_key(path), fill_mode, tuple(size))
+        except OSError:
+            return
+        with self.lock:
+            image = self.scaled_images.get(key)
+            if image is not None:
+                self.scaled_images.move_to_end(key)
+                self.scaled_hits += 1
+                return image
+
+        disk_path = self.get_scaled_disk_path(key)
+        image = self.load_scaled_from_disk(disk_path)
+        if image is not None:
+            with self.lock:
+                self.scaled_disk_hits += 1
+        else:
+            source = self.load(path)
+            if source is None:
+                return
+            image = self.scale(source, fill_mode, size)
+            if image is None:
+                return
+            with self.lock:
+                self.scaled_misses += 1
+            self.disk_writer.submit(self.save_scaled_to_disk, image, disk_path)
+
+        with self.lock:
+            self.scaled_images[key] = image
+            self.scaled_images.move_to_end(key)
+            while len(self.scaled_images) > self.max_scaled_images:
+                self.scaled_images.popitem(last=False)
+        return image
+
+    @staticmethod
+    def scale(image: Image.Image, fill_mode: str, size: tuple[int, int]) -> Image.Image:
+        if image.mode != "RGBA":
+            image = image.convert("RGBA")
+        if fill_mode == "stretch":
+            return image.resize(size, Image.Resampling.HAMMING)
+        elif fill_mode == "cover":
+            return ImageOps.cover(image, size, Image.Resampling.HAMMING)
+        elif fill_mode == "contain":
+            return ImageOps.contain(image, size, Image.Resampling.HAMMING)
+
+    def get_scaled_disk_path(self, key: tuple) -> str:
+        key_hash = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(SCALED_CACHE, f"{key_hash}.png")
+
+    def load_scaled_from_disk(self, disk_path: str) -> Image.Image:
+        if not os.path.exists(disk_path):
+            return
+        try:
+            with Image.open(disk_path) as file:
+                file.load()
+                image = file.copy()
+            # The modification time is used as last use time when pruning
+            os.utime(disk_path)
+            return image
+        except Exception as e:
+            log.warning(f"Failed to load cached key image {disk_path}: {e}")
+            return
+
+    @log.catch
+    def save_scaled_to_disk(self, image: Image.Image, disk_path: str) -> None:
+        os.makedirs(SCALED_CACHE, exist_ok=True)
+        # Write to a temporary file first, so that a half written image never gets loaded
+        tmp_path = f"{disk_path}.tmp"
+        image.save(tmp_path, format="PNG", compress_level=1)
+        os.replace(tmp_path, disk_path)
+
+        self.n_disk_writes += 1
+        if self.n_disk_writes % self.PRUNE_INTERVAL == 1:
+            self.prune_disk_cache()
+
+    @log.catch
+    def prune_disk_cache(self) -> None:
+        """
+        Removes the least recently used images until the disk cache fits into its limit.
+        Images of old versions of a file are never used again, so they get removed first.
+        """
+        max_bytes = int(gl.settings_manager.get_app_settings().get("performance", {}).get("key-image-cache-mb", 256) * 1024 * 1024)
+
+        files: list[tuple[float, int, str]] = []
+        with os.scandir(SCALED_CACHE) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".png"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+
+        n_bytes = sum(size for _, size, _ in files)
+        n_removed = 0
+        for _, size, path in sorted(files):
+            if n_bytes <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            n_bytes -= size
+            n_removed += 1
+
+        if n_removed > 0:
+            log.info(f"Removed {n_removed} least recently used key images from the disk cache")
+
+    def warm_up(self, paths: set[str]) -> None:
+        """
+        Decodes all given images so that loading a page doesn't have to
+        """
+        for path in paths:
+            self.load(path)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "loaded-images": len(self.images),
+                "scaled-hits": self.scaled_hits,
+                "scaled-disk-hits": self.scaled_disk_hits,
+                "scaled-misses": self.scaled_misses,
+                "scaled-images": len(self.scaled_images),
+            }
+
+
+media_image_cache = MediaImageCache()
@@ -0,0 +1,109 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import numpy as np
+import cv2
+from PIL import Image
+from StreamDeck.ImageHelpers import PILHelper
+from loguru import logger as log
+
+# turbojpeg is optional, cv2 is used if it's not available
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR
+except ImportError:
+    TurboJPEG = None
+
+# Import typing
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from StreamDeck.Devices.StreamDeck import StreamDeck
+
+class NativeKeyEncoder:
+    """
+    Converts key images into the native format of a deck.
+    The flip and rotation of the deck are precomputed as one NumPy index transform, which also swaps the channels to BGR.
+    Only JPEG decks use this fast path, all other formats fall back to PILHelper.
+    """
+    def __init__(self, deck: "StreamDeck"):
+        self.deck = deck
+        self.image_format = deck.key_image_format()
+
+        self.size: tuple[int, int] = self.image_format.get("size")
+        self.fast_path = self.image_format.get("format") == "JPEG" and self.size is not None
+
+        self.index: np.ndarray = None
+        self.output_shape: tuple[int, int] = None
+        if self.fast_path:
+            self.index, self.output_shape = self.build_index_transform()
+
+        self.turbo_jpeg = None
+        if self.fast_path and TurboJPEG is not None:
+            try:
+                self.turbo_jpeg = TurboJPEG()
+            except (OSError, RuntimeError) as e:
+                log.debug(f"Failed to load libturbojpeg, falling back to cv2. Error: {e}")
+
+    def build_index_transform(self) -> tuple[np.ndarray, tuple[int, int]]:
+        """
+        Returns the flat pixel indices of the native image and its shape.
+        Gathering the pixels of a key image with these indices rotates and flips it like PILHelper does.
+        """
+        width, height = self.size
+        index = np.arange(width * height).reshape(height, width)
+
+        rotation = self.image_format.get("rotation") or 0
+        if rotation:
+            # PIL rotates counter clockwise, just like np.rot90
+            index = np.rot90(index, k=(rotation // 90) % 4)
+
+        flip_horizontal, flip_vertical = self.image_format.get("flip", (False, False))
+        if flip_horizontal:
+            index = index[:, ::-1]
+        if flip_vertical:
+            index = index[::-1]
+
+        return np.ascontiguousarray(index).ravel(), index.shape
+
+    def to_bgr_array(self, image: Image.Image) -> np.ndarray:
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+
+        pixels = np.asarray(image)
+        pixels = pixels.reshape(-1, pixels.shape[2])
+        # Gather the transformed pixels and reverse RGB to BGR in one step - this also drops the alpha channel
+        bgr = pixels[self.index[:, None], [2, 1, 0]]
+        return bgr.reshape(self.output_shape[0], self.output_shape[1], 3)
+
+    def encode(self, image: Image.Image) -> bytes:
+        """
+        Returns the image in the native key format of the deck
+        """
+        if not self.fast_path or image.size != tuple(self.size):
+            rgb_image = image.convert("RGB")
+            native_image = PILHelper.to_native_key_format(self.deck, rgb_image)
+            rgb_image.close()
+            return native_image
+
+        bgr = self.to_bgr_array(image)
+
+        if self.turbo_jpeg is not None:
+            return self.turbo_jpeg.encode(bgr, quality=100, pixel_format=TJPF_BGR)
+
+        success, buffer = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, 100])
+        if not success:
+            rgb_image = image.convert("RGB")
+            native_image = PILHelper.to_native_key_format(self.deck, rgb_image)
+            rgb_image.close()
+            return native_image
+        return buffer.tobytes()
@@ -0,0 +1,141 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+import pickle
+import threading
+import time
+from loguru import logger as log
+
+import globals as gl
+
+NATIVE_CACHE = os.path.join(gl.DATA_PATH, "cache", "videos", "native")
+
+class NativeTileCache:
+    """
+    Stores the device native images of background video tiles per (frame, key).
+    Only used for keys that show nothing but their tile, so looping playback only has to write the stored bytes to the deck.
+    The native images depend on the key image format of the deck, so the on-disk cache is stored per format.
+    """
+    def __init__(self, video_md5: str, key_layout_str: str, image_format: dict, enabled: bool = True, max_bytes: int = 256 * 1024 * 1024):
+        self.video_md5 = video_md5
+        self.key_layout_str = key_layout_str
+        self.format_str = self.get_format_str(image_format)
+
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+
+        self.lock = threading.Lock()
+        self.cache: dict[int, dict[int, bytes]] = {}
+        self.n_bytes: int = 0
+        self.full: bool = False
+
+        self.changed_since_save: bool = False
+
+        if self.enabled:
+            threading.Thread(target=self.load, name="load_native_tile_cache", daemon=True).start()
+
+    @staticmethod
+    def get_format_str(image_format: dict) -> str:
+        size = image_format.get("size") or (0, 0)
+        flip = image_format.get("flip") or (False, False)
+        return f"{image_format.get('format')}-{size[0]}x{size[1]}-flip{int(flip[0])}{int(flip[1])}-rot{image_format.get('rotation') or 0}"
+
+    def get_path(self) -> str:
+        return os.path.join(NATIVE_CACHE, self.format_str, self.key_layout_str, f"{self.video_md5}.native")
+
+    def get(self, n: int, key_index: int) -> bytes:
+        if not self.enabled:
+            return
+        return self.cache.get(n, {}).get(key_index)
+
+    def set(self, n: int, key_index: int, native_image: bytes) -> None:
+        if not self.enabled or self.full:
+            return
+        native_image = bytes(native_image) # PILHelper returns memoryviews which can't be pickled
+        with self.lock:
+            frame = self.cache.setdefault(n, {})
+            if key_index in frame:
+                return
+            if self.n_bytes + len(native_image) > self.max_bytes:
+                self.full = True
+                log.info(f"Native tile cache of video {self.video_md5} reached its limit of {self.max_bytes / 1024 / 1024:.0f} MB")
+                return
+            frame[key_index] = native_image
+            self.n_bytes += len(native_image)
+            self.changed_since_save = True
+
+    def get_memory_usage(self) -> int:
+        """
+        Returns the size of all stored native images in bytes
+        """
+        return self.n_bytes
+
+    def save_threaded(self) -> None:
+        if not self.enabled or not self.changed_since_save:
+            return
+        threading.Thread(target=self.save, name="save_native_tile_cache", daemon=True).start()
+
+    @log.catch
+    def save(self) -> None:
+        start = time.time()
+        with self.lock:
+            if not self.changed_since_save:
+                return
+            data = {n: dict(keys) for n, keys in self.cache.items()}
+            self.changed_since_save = False
+
+        path = self.get_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(data, f)
+        os.replace(tmp_path, path)
+
+        log.success(f"Saved native tile cache in {time.time() - start:.2f} seconds")
+
+    @log.catch
+    def load(self) -> None:
+        path = self.get_path()
+        if not os.path.exists(path):
+            return
+
+        start = time.time()
+        try:
+            with open(path, "rb") as f:
+                data: dict[int, dict[int, bytes]] = pickle.load(f)
+        except Exception as e:
+            os.remove(path)
+            log.error(f"Failed to load native tile cache: {e}")
+            return
+
+        with self.lock:
+            for n, keys in data.items():
+                frame = self.cache.setdefault(n, {})
+                for key_index, native_image in keys.items():
+                    if key_index in frame:
+                        continue
+                    if self.n_bytes + len(native_image) > self.max_bytes:
+                        self.full = True
+                        break
+                    frame[key_index] = native_image
+                    self.n_bytes += len(native_image)
+
+        log.success(f"Loaded native tile cache in {time.time() - start:.2f} seconds")
+
+    def clear(self) -> None:
+        with self.lock:
+            self.cache.clear()
+            self.n_bytes = 0
+            self.full = False
@@ -0,0 +1,324 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import weakref
+import numpy as np
+from PIL import Image
+from loguru import logger as log
+
+class RawFrameStore:
+    """
+    Memory mapped cache file of the uncompressed key tiles of a video.
+
+    Layout:
+        header: magic, version, n_frames, key_count, tile width, tile height, channels
+        frame index: one byte per frame, 1 if the frame has been written
+        frames: n_frames fixed size frames, each containing the tiles of all keys in key order
+
+    Tiles are returned as zero-copy views into the mapping, so only the frames that are actually shown
+    get paged in and decks playing the same video share the pages through the kernel page cache.
+    The space of the file is allocated up front - writing to an unallocated page of a mapping on a full disk
+    would kill the process with SIGBUS instead of raising an error.
+    """
+    MAGIC = b"SCFRAMES"
+    VERSION = 1
+    HEADER = struct.Struct("<8sIIIIII")
+    CHANNELS = 3
+
+    # path -> number of stores that have the file open, these files are never pruned
+    open_paths: dict[str, int] = {}
+    open_paths_lock = threading.Lock()
+
+    def __init__(self, path: str, n_frames: int, key_count: int, key_size: tuple[int, int]):
+        self.path = os.path.abspath(path)
+        self.n_frames = max(0, n_frames)
+        self.key_count = key_count
+        self.key_width, self.key_height = key_size
+
+        self.tile_stride = self.key_width * self.key_height * self.CHANNELS
+        self.frame_stride = self.tile_stride * self.key_count
+        self.index_offset = self.HEADER.size
+        # Align the frames to the page size
+        self.data_offset = (self.index_offset + self.n_frames + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+        self.file_size = self.data_offset + self.n_frames * self.frame_stride
+
+        self.lock = threading.Lock()
+        self.mm: mmap.mmap = None
+        self.fd: int = None
+        self.n_written: int = 0
+        # Closes the fd and unpins the path if the store gets collected without being closed
+        self.finalizer: weakref.finalize = None
+
+        self.open()
+
+    def get_header(self) -> bytes:
+        return self.HEADER.pack(self.MAGIC, self.VERSION, self.n_frames, self.key_count, self.key_width, self.key_height, self.CHANNELS)
+
+    @log.catch
+    def open(self) -> None:
+        if self.n_frames == 0 or self.key_count == 0:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        fd = self.open_locked()
+        try:
+            header = os.pread(fd, self.HEADER.size, 0)
+            if header != self.get_header() or os.fstat(fd).st_size != self.file_size:
+                # New or incompatible file - other stores might have the old file mapped, so it gets replaced instead of truncated
+                new_fd = self.create_file()
+                os.close(fd)
+                fd = new_fd
+            else:
+                # Files of older versions are sparse, allocating is a no-op for allocated files
+                os.posix_fallocate(fd, 0, self.file_size)
+            self.mm = mmap.mmap(fd, self.file_size)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        except:
+            os.close(fd)
+            raise
+        # Kept open to drop evicted frames from the page cache
+        self.fd = fd
+
+        with self.open_paths_lock:
+            self.open_paths[self.path] = self.open_paths.get(self.path, 0) + 1
+        self.finalizer = weakref.finalize(self, RawFrameStore.release_file, fd, self.path)
+        # The modification time is used as last use time when pruning
+        os.utime(self.path)
+
+        self.n_written = self.mm[self.index_offset:self.index_offset + self.n_frames].count(1)
+
+    @staticmethod
+    def release_file(fd: int, path: str) -> None:
+        """
+        Closes the fd of a store and removes its pin, must not reference the store itself
+        """
+        os.close(fd)
+        with RawFrameStore.open_paths_lock:
+            RawFrameStore.open_paths[path] -= 1
+            if RawFrameStore.open_paths[path] <= 0:
+                del RawFrameStore.open_paths[path]
+
+    def open_locked(self) -> int:
+        """
+        Opens the file and locks it exclusively, so that only one store checks and replaces it at a time
+        """
+        while True:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            # The file got replaced while waiting for the lock
+            os.close(fd)
+
+    def create_file(self) -> int:
+        """
+        Creates an empty store with all space allocated and moves it to the path. Returns its locked fd.
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            # Raises if the disk is full
+            os.posix_fallocate(fd, 0, self.file_size)
+            os.pwrite(fd, self.get_header(), 0)
+            os.fchmod(fd, 0o644)
+            os.replace(tmp_path, self.path)
+        except:
+            os.close(fd)
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return fd
+
+    def is_open(self) -> bool:
+        return self.mm is not None
+
+    def has_frame(self, n: int) -> bool:
+        if self.mm is None or not 0 <= n < self.n_frames:
+            return False
+        return self.mm[self.index_offset + n] == 1
+
+    def is_complete(self) -> bool:
+        if self.mm is None:
+            return False
+        if self.n_written < self.n_frames:
+            # Other stores of the same file might have written frames in the meantime
+            self.n_written = self.mm[self.index_offset:self.index_offset + self.n_frames].count(1)
+        return self.n_written == self.n_frames
+
+    def write_frame(self, n: int, tiles: np.ndarray) -> None:
+        """
+        Args:
+            n (int): Index of the frame
+            tiles (np.ndarray): uint8 array with the RGB tiles of all keys in key order, e.g. (rows, cols, height, width, 3)
+        """
+        if self.mm is None or not 0 <= n < self.n_frames:
+            return
+        data = np.ascontiguousarray(tiles, dtype=np.uint8).data.cast("B")
+        if len(data) != self.frame_stride:
+            log.error(f"Frame {n} has {len(data)} bytes, expected {self.frame_stride}")
+            return
+
+        with self.lock:
+            if self.mm is None or self.has_frame(n):
+                return
+            offset = self.data_offset + n * self.frame_stride
+            self.mm[offset:offset + self.frame_stride] = data
+            # Only mark the frame as written once its data is complete
+            self.mm[self.index_offset + n] = 1
+            self.n_written += 1
+
+    def get_tiles(self, n: int) -> list[Image.Image]:
+        """
+        Returns the tiles of the given frame as zero-copy views or None if the frame hasn't been written yet
+        """
+        mm = self.mm
+        if mm is None or not self.has_frame(n):
+            return
+        view = memoryview(mm)
+        offset = self.data_offset + n * self.frame_stride
+        size = (self.key_width, self.key_height)
+
+        tiles: list[Image.Image] = []
+        for key in range(self.key_count):
+            start = offset + key * self.tile_stride
+            tiles.append(Image.frombuffer("RGB", size, view[start:start + self.tile_stride], "raw", "RGB", 0, 1))
+        return tiles
+
+    def get_frame_range(self, n: int) -> tuple[int, int]:
+        """
+        Returns the page aligned (offset, length) of the pages that only belong to the given frame
+        """
+        start = self.data_offset + n * self.frame_stride
+        end = start + self.frame_stride
+        start = (start + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+        end = end // mmap.PAGESIZE * mmap.PAGESIZE
+        return start, max(0, end - start)
+
+    def prefetch_frame(self, n: int) -> None:
+        """
+        Asks the kernel to read the frame ahead of time
+        """
+        if not self.has_frame(n):
+            return
+        offset, length = self.get_frame_range(n)
+        if length > 0:
+            self.mm.madvise(mmap.MADV_WILLNEED, offset, length)
+
+    def evict_frame(self, n: int) -> None:
+        """
+        Drops the frame from memory, it gets read from the file again the next time it is used
+        """
+        if not self.has_frame(n):
+            return
+        offset, length = self.get_frame_range(n)
+        if length == 0:
+            return
+        with self.lock:
+            if self.mm is None:
+                return
+            self.mm.madvise(mmap.MADV_DONTNEED, offset, length)
+            # Unmapping only drops the pages from the process, this also drops them from the page cache
+            os.posix_fadvise(self.fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+    def flush(self) -> None:
+        with self.lock:
+            if self.mm is not None:
+                self.mm.flush()
+
+    def close(self) -> None:
+        with self.lock:
+            if self.mm is None:
+                return
+            mm = self.mm
+            self.mm = None
+            mm.flush()
+            # Runs release_file only once, even if the store gets collected later
+            self.finalizer()
+            self.fd = None
+            try:
+                mm.close()
+            except BufferError:
+                # Tiles still reference the mapping, it gets unmapped once they are garbage collected
+                pass
+
+
+prune_lock = threading.Lock()
+
+@log.catch
+def prune_frame_stores(directory: str, max_bytes: int) -> None:
+    """
+    Removes the least recently used frame stores in the directory and its subdirectories until they take
+    at most max_bytes. Stores that are open are kept.
+    """
+    with prune_lock:
+        stores: list[tuple[float, int, str]] = []
+        for root, _, files in os.walk(directory):
+            for file in files:
+                if not file.endswith(".frames"):
+                    continue
+                path = os.path.abspath(os.path.join(root, file))
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                stores.append((stat.st_mtime, stat.st_blocks * 512, path))
+
+        n_bytes = sum(size for _, size, _ in stores)
+        for _, size, path in sorted(stores):
+            if n_bytes <= max_bytes:
+                break
+            with RawFrameStore.open_paths_lock:
+                if path in RawFrameStore.open_paths:
+                    continue
+                os.remove(path)
+            n_bytes -= size
+            log.info(f"Removed least recently used video frame cache {path} ({size / 1024 / 1024:.1f} MB)")
+
+@log.catch
+def remove_stale_stores(keep_path: str, prefix: str, max_age: float = 7 * 24 * 60 * 60) -> None:
+    """
+    Removes the stores next to keep_path whose name starts with prefix and that haven't been opened for max_age seconds,
+    e.g. the stores of the same video in a frame size that is no longer used.
+    Stores of other sizes that are still in use, e.g. by a deck with other key sizes, get opened regularly and are kept.
+    """
+    keep_path = os.path.abspath(keep_path)
+    directory = os.path.dirname(keep_path)
+    for file in os.listdir(directory):
+        path = os.path.join(directory, file)
+        if not file.startswith(prefix) or not file.endswith(".frames") or path == keep_path:
+            continue
+        with RawFrameStore.open_paths_lock:
+            if path in RawFrameStore.open_paths:
+                continue
+            try:
+                # The modification time gets touched whenever a store is opened
+                if time.time() - os.stat(path).st_mtime < max_age:
+                    continue
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+        log.info(f"Removed stale video frame cache {path}")
+
+def prune_frame_stores_threaded(directory: str, max_bytes: int) -> None:
+    threading.Thread(target=prune_frame_stores, args=(directory, max_bytes), name="prune_frame_stores", daemon=True).start()
@@ -0,0 +1,97 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import threading
+from loguru import logger as log
+
+MB = 1024 * 1024
+
+class VideoCacheBudget:
+    """
+    Process wide memory budget of the video caches.
+    Each cache reserves the memory it wants to keep resident. A reservation gets at most what is left of
+    the global budget and of the budget of its deck, caches that get less have to evict or stream instead.
+    """
+    def __init__(self, global_bytes: int = 1024 * MB, per_deck_bytes: int = 512 * MB):
+        self.global_bytes = global_bytes
+        self.per_deck_bytes = per_deck_bytes
+
+        self.lock = threading.Lock()
+        # deck serial number -> owner -> reserved bytes
+        self.reservations: dict[str, dict[object, int]] = {}
+
+    def set_limits(self, global_mb: int = None, per_deck_mb: int = None) -> None:
+        """
+        Only affects new reservations
+        """
+        with self.lock:
+            if global_mb is not None:
+                self.global_bytes = int(global_mb * MB)
+            if per_deck_mb is not None:
+                self.per_deck_bytes = int(per_deck_mb * MB)
+
+    def load_limits_from_settings(self, performance_settings: dict) -> None:
+        self.set_limits(
+            global_mb=performance_settings.get("video-cache-mb", self.global_bytes // MB),
+            per_deck_mb=performance_settings.get("video-cache-per-deck-mb", self.per_deck_bytes // MB)
+        )
+
+    def reserve(self, deck_serial: str, owner: object, n_bytes: int) -> int:
+        """
+        Reserves up to n_bytes for the owner, replacing its previous reservation
+
+        Returns:
+            int: The granted number of bytes
+        """
+        with self.lock:
+            deck_reservations = self.reservations.setdefault(deck_serial, {})
+            deck_reservations.pop(owner, None)
+
+            deck_used = sum(deck_reservations.values())
+            global_used = sum(sum(r.values()) for r in self.reservations.values())
+
+            available = min(self.per_deck_bytes - deck_used, self.global_bytes - global_used)
+            granted = max(0, min(n_bytes, available))
+            if granted > 0:
+                deck_reservations[owner] = granted
+
+        if granted < n_bytes:
+            log.debug(f"Video cache budget: granted {granted / MB:.1f} of {n_bytes / MB:.1f} MB on deck {deck_serial}")
+        return granted
+
+    def release(self, deck_serial: str, owner: object) -> None:
+        with self.lock:
+            deck_reservations = self.reservations.get(deck_serial)
+            if deck_reservations is None:
+                return
+            deck_reservations.pop(owner, None)
+            if not deck_reservations:
+                del self.reservations[deck_serial]
+
+    def get_usage(self) -> int:
+        """
+        Returns the reserved bytes of all decks
+        """
+        with self.lock:
+            return sum(sum(r.values()) for r in self.reservations.values())
+
+    def get_deck_usage(self) -> dict[str, int]:
+        """
+        Returns the reserved bytes per deck serial number
+        """
+        with self.lock:
+            return {serial: sum(r.values()) for serial, r in self.reservations.items()}
+
+
+video_cache_budget = VideoCacheBudget()
@@ -0,0 +1,222 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import threading
+import numpy as np
+import cv2
+from loguru import logger as log
+
+from src.backend.FingerprintService import fingerprint_service
+
+# Import typing
+from typing import Protocol
+
+class FrameSubscriber(Protocol):
+    def needs_frame(self, n: int) -> bool:
+        """
+        Whether the subscriber wants to get the frame when it gets decoded for someone else
+        """
+    def on_frame_decoded(self, n: int, frame: np.ndarray) -> None:
+        """
+        Called on the decoding thread, must not wait for locks that are held while calling SharedVideoDecoder.get_frame
+        """
+
+
+class ReadHead:
+    """
+    A video capture and the position it has been read to
+    """
+    def __init__(self, video_path: str):
+        self.cap = cv2.VideoCapture(video_path)
+        self.last_frame_index: int = -1
+        self.last_used: int = 0
+
+    def seek(self, n: int) -> None:
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, n)
+        self.last_frame_index = n - 1
+
+    def close(self) -> None:
+        self.cap.release()
+
+
+class SharedVideoDecoder:
+    """
+    The video captures shared by all decks that show the same video.
+    Every decoded full resolution frame is handed to all subscribers that still need it, so each frame only gets decoded
+    once no matter how many decks and layouts use the video.
+    Decks can play the video at different positions. Seeking re-decodes from the previous keyframe, so each capture
+    (read head) only serves requests that continue its position. Requests elsewhere get their own head, up to one per subscriber.
+    """
+    # Reading forward up to this many frames is cheaper than seeking
+    MAX_READ_AHEAD = 15
+
+    def __init__(self, video_path: str, video_hash: str):
+        self.video_path = video_path
+        self.video_hash = video_hash
+
+        self.lock = threading.Lock()
+        self.heads: list[ReadHead] = [ReadHead(video_path)]
+        self.n_frames = int(self.heads[0].cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.fps: float = self.heads[0].cap.get(cv2.CAP_PROP_FPS)
+        self.closed = False
+
+        self.last_frame_index: int = -1
+        self.last_frame: np.ndarray = None
+        self.n_requests: int = 0
+        self.n_seeks: int = 0
+
+        self.subscribers: list[FrameSubscriber] = []
+
+    def subscribe(self, subscriber: FrameSubscriber) -> None:
+        with self.lock:
+            if subscriber not in self.subscribers:
+                self.subscribers.append(subscriber)
+
+    def unsubscribe(self, subscriber: FrameSubscriber) -> None:
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+            # Drop the least recently used heads that no subscriber needs anymore
+            self.heads.sort(key=lambda head: head.last_used, reverse=True)
+            while len(self.heads) > max(1, len(self.subscribers)):
+                self.heads.pop().close()
+
+    def get_frame(self, n: int) -> np.ndarray:
+        """
+        Decodes the video up to the nth frame and returns it as a read-only BGR array.
+        Returns the last decoded frame if the nth frame is not available.
+        """
+        return self.get_indexed_frame(n)[0]
+
+    def get_indexed_frame(self, n: int) -> tuple[np.ndarray, int]:
+        """
+        Like get_frame, but also returns the index of the returned frame - it differs from n if the nth frame is not available
+        """
+        with self.lock:
+            if self.closed or n == self.last_frame_index:
+                return self.last_frame, self.last_frame_index
+
+            self.n_requests += 1
+            head = self.get_head(n)
+            head.last_used = self.n_requests
+
+            # Decode frames until the nth frame
+            while head.last_frame_index < n:
+                index = head.last_frame_index + 1
+                if index < n and not self.is_frame_needed(index):
+                    # Skipped frames don't have to be converted
+                    success = head.cap.grab()
+                    frame = None
+                else:
+                    success, frame = head.cap.read()
+                if not success:
+                    break  # Reached the end of the video
+                head.last_frame_index = index
+                if frame is None:
+                    continue
+
+                frame.flags.writeable = False
+                self.last_frame = frame
+                self.last_frame_index = index
+
+                for subscriber in self.subscribers:
+                    if not subscriber.needs_frame(index):
+                        continue
+                    try:
+                        subscriber.on_frame_decoded(index, frame)
+                    except Exception as e:
+                        log.error(f"Failed to hand frame {index} of {self.video_path} to a subscriber: {e}")
+
+            return self.last_frame, self.last_frame_index
+
+    def get_head(self, n: int) -> ReadHead:
+        """
+        Returns the head that reaches the nth frame by reading forward, opens or seeks one if there is none
+        """
+        best = None
+        for head in self.heads:
+            gap = n - head.last_frame_index
+            if 0 < gap <= self.MAX_READ_AHEAD and (best is None or gap < n - best.last_frame_index):
+                best = head
+        if best is not None:
+            return best
+
+        if len(self.heads) < max(1, len(self.subscribers)):
+            best = ReadHead(self.video_path)
+            self.heads.append(best)
+        else:
+            best = min(self.heads, key=lambda head: head.last_used)
+        if best.last_frame_index != n - 1:
+            best.seek(n)
+            self.n_seeks += 1
+        return best
+
+    def is_frame_needed(self, n: int) -> bool:
+        return any(subscriber.needs_frame(n) for subscriber in self.subscribers)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "heads": len(self.heads),
+                "requests": self.n_requests,
+                "seeks": self.n_seeks,
+            }
+
+    def close(self) -> None:
+        with self.lock:
+            for head in self.heads:
+                head.close()
+            self.heads = []
+            self.closed = True
+            self.last_frame = None
+
+
+class VideoDecodeBroker:
+    """
+    Process wide registry of the shared video decoders, keyed by the hash of the video.
+    A decoder gets closed once its last subscriber releases it.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.decoders: dict[str, SharedVideoDecoder] = {}
+
+    def get_video_hash(self, video_path: str) -> str:
+        """
+        Returns the md5 hash of the video, it only gets calculated again if the file changed
+        """
+        # The caches on disk are named after the md5 hash
+        return fingerprint_service.get_digest(video_path, "md5")
+
+    def acquire(self, video_path: str, subscriber: FrameSubscriber) -> SharedVideoDecoder:
+        video_hash = self.get_video_hash(video_path)
+        with self.lock:
+            decoder = self.decoders.get(video_hash)
+            if decoder is None:
+                decoder = SharedVideoDecoder(video_path, video_hash)
+                self.decoders[video_hash] = decoder
+            decoder.subscribe(subscriber)
+            log.debug(f"Video {video_path} is decoded for {len(decoder.subscribers)} subscriber(s)")
+        return decoder
+
+    def release(self, decoder: SharedVideoDecoder, subscriber: FrameSubscriber) -> None:
+        with self.lock:
+            decoder.unsubscribe(subscriber)
+            if decoder.subscribers:
+                return
+            decoder.close()
+            if self.decoders.get(decoder.video_hash) is decoder:
+                del self.decoders[decoder.video_hash]
+
+
+video_decode_broker = VideoDecodeBroker()
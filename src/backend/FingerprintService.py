@@ -0,0 +1,157 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import Python modules
+import atexit
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from loguru import logger as log
+
+# Import globals
+import globals as gl
+
+class FingerprintService:
+    """
+    Content hashes of files, shared by the asset manager, the thumbnails and the video caches.
+    Digests are stored in a persistent index keyed by (device, inode, size, mtime_ns, algorithm), so an unchanged file
+    never gets hashed again - not even after a restart. Files are hashed on a worker pool and a file that is already
+    being hashed is not hashed a second time.
+    """
+    SAVE_DELAY = 2
+    MAX_ENTRIES = 10000
+
+    def __init__(self, max_workers: int = 2):
+        self.index_path = os.path.join(gl.DATA_PATH, "cache", "fingerprints.json")
+
+        self.lock = threading.Lock()
+        self.index: dict[str, str] = self.load_index()
+        self.in_flight: dict[str, Future] = {}
+        self.save_timer: threading.Timer = None
+        # Whether the index changed since it was saved
+        self.dirty = False
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fingerprint")
+
+        self.hits: int = 0
+        self.misses: int = 0
+
+        atexit.register(self.save_index)
+
+    def get_index_key(self, file_path: str, algorithm: str) -> str:
+        stat = os.stat(file_path)
+        return f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}:{algorithm}"
+
+    def get_digest(self, file_path: str, algorithm: str = "sha256") -> str:
+        """
+        Returns the hex digest of the file, None if the file does not exist
+        """
+        future = self.submit(file_path, algorithm)
+        if future is None:
+            return
+        return future.result()
+
+    def submit(self, file_path: str, algorithm: str = "sha256") -> Future:
+        """
+        Returns a future of the hex digest of the file, None if the file does not exist
+        """
+        try:
+            key = self.get_index_key(file_path, algorithm)
+        except OSError:
+            return
+
+        with self.lock:
+            digest = self.index.get(key)
+            if digest is not None:
+                self.hits += 1
+                future = Future()
+                future.set_result(digest)
+                return future
+
+            future = self.in_flight.get(key)
+            if future is not None:
+                return future
+
+            self.misses += 1
+            future = self.executor.submit(self.hash_file, file_path, algorithm, key)
+            self.in_flight[key] = future
+            return future
+
+    def hash_file(self, file_path: str, algorithm: str, key: str) -> str:
+        try:
+            with open(file_path, "rb") as f:
+                digest = hashlib.file_digest(f, algorithm).hexdigest()
+        except Exception:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            raise
+
+        with self.lock:
+            self.index[key] = digest
+            self.in_flight.pop(key, None)
+            self.dirty = True
+            # Drop the oldest entries, dicts keep the insertion order
+            for old_key in list(self.index.keys())[:len(self.index) - self.MAX_ENTRIES]:
+                del self.index[old_key]
+        self.schedule_save()
+        return digest
+
+    def load_index(self) -> dict[str, str]:
+        if not os.path.exists(self.index_path):
+            return {}
+        try:
+            with open(self.index_path) as f:
+                return json.load(f)
+        except (OSError, json.decoder.JSONDecodeError) as e:
+            log.warning(f"Failed to load the fingerprint index, starting with an empty one: {e}")
+            return {}
+
+    def schedule_save(self) -> None:
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+            self.save_timer = threading.Timer(self.SAVE_DELAY, self.save_index)
+            self.save_timer.name = "save_fingerprint_index"
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    @log.catch
+    def save_index(self) -> None:
+        with self.lock:
+            if self.save_timer is not None:
+                self.save_timer.cancel()
+                self.save_timer = None
+            if not self.dirty:
+                return
+            index = dict(self.index)
+            self.dirty = False
+
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self.index),
+            }
+
+
+fingerprint_service = FingerprintService()
@@ -13,19 +13,21 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 from argparse import Action
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 import gc
 import os
 import json
 import threading
 import time
 from loguru import logger as log
-from copy import copy
+from copy import copy, deepcopy
 import shutil
 
 # Import globals
 import globals as gl
 
 from src.backend.PluginManager.ActionBase import ActionBase
+from src.backend.PageManagement.PageModel import PageModel
 # Import typing
 from typing import TYPE_CHECKING
 if TYPE_CHECKING:
@@ -33,10 +35,14 @@ if TYPE_CHECKING:
     from src.backend.DeckManagement.DeckController import ControllerKeyState, ControllerKey
 
 class Page:
+    # Maximum number of threads used to construct the actions of a page
+    MAX_ACTION_LOAD_WORKERS = 8
+
     def __init__(self, json_path, deck_controller, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self.dict = {}
+        # The parsed json is shared with the pages of the other decks showing this page
+        self.model: PageModel = gl.page_manager.get_page_model(json_path)
 
         self.json_path = json_path
         self.deck_controller = deck_controller
@@ -44,9 +50,23 @@ class Page:
         # Dir that contains all actions this allows us to keep them at reload
         self.action_objects = {}
 
+        # Serialized config of each key and of the rest of the page at the last load, used to find what changed
+        self.loaded_key_configs: dict[str, str] = {}
+        self.loaded_page_config: str = None
+        # Keys whose config changed during the last load, None if the config outside of the keys changed
+        self.changed_keys: set[str] = None
+
         self.ready_to_clear = True
 
-        self.load(load_from_file=True)
+        self.load(load_from_file=not self.model.loaded)
+
+    @property
+    def dict(self) -> dict:
+        return self.model.dict
+
+    @dict.setter
+    def dict(self, value: dict) -> None:
+        self.model.dict = value
 
     def get_name(self) -> str:
         return os.path.splitext(os.path.basename(self.json_path))[0]
@@ -56,27 +76,51 @@ class Page:
         Updates the dict without any updates on the action objects.
         Do NOT use if you made changes to the action objects
         """
-        self.dict = gl.page_manager.get_page_json(self.json_path)
+        self.model.reload()
     
-    def load(self, load_from_file: bool = False):
+    def load(self, load_from_file: bool = False) -> set[str]:
+        """
+        Returns:
+            set[str]: The coords of the keys whose config changed since the last load, None if the config outside of the keys
+            (e.g. the background) changed as well
+        """
         start = time.time()
         if load_from_file:
             self.update_dict()
+        self.changed_keys = self.get_changed_keys()
         self.load_action_objects()
 
         # Call on_ready for all actions
         end = time.time()
         log.debug(f"Loaded page {self.get_name()} in {end - start:.2f} seconds")
+        return self.changed_keys
 
-    def save(self):
-        # Make backup in case something goes wrong
-        self.make_backup()
+    def get_changed_keys(self) -> set[str]:
+        """
+        Compares the config of each key with the one of the last load and remembers the current one.
+        Returns None if the config outside of the keys changed.
+        """
+        page_config = json.dumps({k: v for k, v in self.dict.items() if k != "keys"}, sort_keys=True, default=str)
+        page_config_changed = page_config != self.loaded_page_config
+        self.loaded_page_config = page_config
+
+        key_configs: dict[str, str] = {}
+        for key, key_dict in self.dict.get("keys", {}).items():
+            key_configs[key] = json.dumps(key_dict, sort_keys=True, default=str)
 
-        without_objects = self.get_without_action_objects()
-        # Make keys last element
-        self.move_key_to_end(without_objects, "keys")
-        with open(self.json_path, "w") as f:
-            json.dump(without_objects, f, indent=4)
+        changed_keys = set()
+        for key in key_configs.keys() | self.loaded_key_configs.keys():
+            if key_configs.get(key) != self.loaded_key_configs.get(key):
+                changed_keys.add(key)
+
+        self.loaded_key_configs = key_configs
+        if page_config_changed:
+            return None
+        return changed_keys
+
+    def save(self):
+        # The page manager coalesces saves and writes the page shortly after
+        gl.page_manager.save_queue.schedule(self)
 
     def make_backup(self):
         os.makedirs(os.path.join(gl.DATA_PATH, "pages","backups"), exist_ok=True)
@@ -95,9 +139,9 @@ class Page:
         shutil.copy2(src_path, dst_path)
 
     def move_key_to_end(self, dictionary, key):
-        if key in self.dict:
-            value = self.dict.pop(key)
-            self.dict[key] = value
+        if key in dictionary:
+            value = dictionary.pop(key)
+            dictionary[key] = value
 
     def set_background(self, file_path):
         self.dict.setdefault("background", {})
@@ -108,7 +152,8 @@ class Page:
         # Store loaded action objects
         loaded_action_objects = copy(self.action_objects)
 
-        add_threads: list[threading.Thread] = []
+        # Actions that have to be constructed: (action_holder, key, state, i)
+        new_actions: list[tuple["ActionHolder", str, int, int]] = []
 
         # Load action objects
         self.action_objects = {}
@@ -138,48 +183,39 @@ class Page:
                         self.action_objects[key][state][i] = NoActionHolderFound(id=action["id"])
                         continue
 
+                    # Keep the object if the same action is still configured at this (key, state, index).
+                    # Actions read their settings from the page, so a change of the settings doesn't need a new object.
                     old_object = loaded_action_objects.get(key, {}).get(state, {}).get(i)
-                    
-                    if i in loaded_action_objects.get(key, {}).get(state, {}):
-                        # if isinstance(loaded_action_objects.get(key, {}).get(i), action_class):
-                        if old_object is not None:
-                            if isinstance(old_object, action_class):
-                                self.action_objects[key][state][i] = loaded_action_objects[key][state][i]
-                                continue
-
-                    # action_object = action_holder.init_and_get_action(deck_controller=self.deck_controller, page=self, coords=key)
-                    # self.action_objects[key][i] = action_object
+                    if isinstance(old_object, action_class):
+                        self.action_objects[key][state][i] = old_object
+                        continue
+
                     if self.deck_controller.coords_to_index(key.split("x")) > self.deck_controller.deck.key_count():
                         continue
-                    thread = threading.Thread(target=self.add_action_object_from_holder, args=(action_holder, key, state, i), name=f"add_action_object_from_holder_{key}_{state}_{i}")
-                    thread.start()
-                    add_threads.append(thread)
-
-        all_threads_finished = False
-        while not all_threads_finished:
-            all_threads_finished = True
-            for thread in add_threads:
-                if thread.is_alive():
-                    all_threads_finished = False
-                    break
-            time.sleep(0.02)
-
-        all_old_objects: list[ActionBase] = []
-        for key in loaded_action_objects:
-            for i in loaded_action_objects[key]:
-                all_old_objects.append(loaded_action_objects[key][i])
-
-        all_action_objects: list[ActionBase] = []
-        for key in self.action_objects:
-            for i in self.action_objects[key]:
-                all_action_objects.append(self.action_objects[key][i])
+                    new_actions.append((action_holder, key, state, i))
 
-        for action in all_old_objects:
-            if action not in all_action_objects:
-                if isinstance(action, ActionBase):
-                    action.on_removed_from_cache()
-                    action.page = None
-                del action
+        if new_actions:
+            # Construct only the new actions
+            with ThreadPoolExecutor(max_workers=min(self.MAX_ACTION_LOAD_WORKERS, len(new_actions)), thread_name_prefix="add_action_object_from_holder") as executor:
+                futures: list[Future] = [executor.submit(self.add_action_object_from_holder, *new_action) for new_action in new_actions]
+                wait(futures)
+
+        all_action_objects = self.get_all_action_objects(self.action_objects)
+        for action in self.get_all_action_objects(loaded_action_objects):
+            if any(action is a for a in all_action_objects):
+                continue
+            if isinstance(action, ActionBase):
+                action.on_removed_from_cache()
+                action.page = None
+            del action
+
+    @staticmethod
+    def get_all_action_objects(action_objects: dict) -> list:
+        objects = []
+        for key in action_objects.values():
+            for state in key.values():
+                objects.extend(state.values())
+        return objects
 
     def move_actions(self, from_key: str, to_key: str):
         from_actions = self.action_objects.get(from_key, {})
@@ -262,7 +298,18 @@ class Page:
         self.save()
 
     def get_without_action_objects(self):
-        dictionary = copy(self.dict)
+        """
+        Returns a deep copy of the page dict without the action objects, the live dict is not touched
+        """
+        # Action objects must not be copied, so they get copied as None and removed afterwards
+        memo = {}
+        for key_dict in self.dict.get("keys", {}).values():
+            for state_dict in key_dict.get("states", {}).values():
+                for action in state_dict.get("actions", []):
+                    if "object" in action:
+                        memo[id(action["object"])] = None
+        dictionary = deepcopy(self.dict, memo)
+
         for key in dictionary.get("keys", {}):
             for state in dictionary["keys"][key].get("states", {}):
                 if "actions" not in dictionary["keys"][key]["states"][state]:
@@ -390,14 +437,74 @@ class Page:
                              load_brightness: bool = True, load_screensaver: bool = True, load_background: bool = True, load_keys: bool = True):
         self.save()
         for page in self.get_pages_with_same_json(get_self=reload_self):
-            page.load(load_from_file=True)
+            # The pages share the dict, so the changes don't have to be read from the file
+            changed_keys = page.load()
             if page_coords is None:
-                page.deck_controller.load_page(page, load_brightness, load_screensaver, load_background, load_keys)
+                page.deck_controller.load_page(page, load_brightness, load_screensaver, load_background, load_keys, changed_keys=changed_keys)
             else:
                 key_index = page.deck_controller.coords_to_index(page_coords.split("x"))
                 # Reload only given key
                 page.deck_controller.load_key(key_index, page.deck_controller.active_page)
 
+    def get_label_fonts(self) -> set[tuple[str, int]]:
+        """
+        Returns all (font family, font size) combinations used by the labels of this page
+        """
+        fonts: set[tuple[str, int]] = set()
+        for key in self.dict.get("keys", {}).values():
+            for state in key.get("states", {}).values():
+                for label in state.get("labels", {}).values():
+                    if label.get("text") in ["", None]:
+                        continue
+                    family = label.get("font-family") or ""
+                    size = label.get("font-size") or 15
+                    fonts.add((family, size))
+        return fonts
+
+    def get_media_paths(self) -> set[str]:
+        """
+        Returns the paths of the media of all keys
+        """
+        return self.model.get_media_paths()
+
+    def get_media_layouts(self) -> set[tuple[str, str, float]]:
+        """
+        Returns the (path, fill mode, size) of the media of all keys, with the defaults of ControllerKeyLayoutManager
+        """
+        layouts: set[tuple[str, str, float]] = set()
+        for key in self.dict.get("keys", {}).values():
+            for state in key.get("states", {}).values():
+                media = state.get("media", {})
+                if media.get("path") in ["", None]:
+                    continue
+                layouts.add((media["path"], media.get("fill-mode") or "cover", media.get("size") or 1))
+        return layouts
+
+    def get_linked_page_paths(self, page_paths: list[str]) -> list[str]:
+        """
+        Returns the pages of page_paths that are referenced in the settings of the actions, e.g. by "change page" actions
+        """
+        known_paths = {os.path.abspath(path): path for path in page_paths}
+        linked: list[str] = []
+
+        def find_paths(value) -> None:
+            if isinstance(value, dict):
+                for v in value.values():
+                    find_paths(v)
+            elif isinstance(value, list):
+                for v in value:
+                    find_paths(v)
+            elif isinstance(value, str) and value.endswith(".json"):
+                path = known_paths.get(os.path.abspath(value))
+                if path is not None and path not in linked:
+                    linked.append(path)
+
+        for key in self.dict.get("keys", {}).values():
+            for state in key.get("states", {}).values():
+                for action in state.get("actions", []):
+                    find_paths(action.get("settings", {}))
+        return linked
+
     def get_action_comment(self, page_coords: str, index: int, state: int):
         if page_coords in self.action_objects:
             if index in self.action_objects[page_coords]:
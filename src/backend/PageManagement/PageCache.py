@@ -0,0 +1,178 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import threading
+from collections import OrderedDict
+from loguru import logger as log
+
+from src.backend.DeckManagement.HelperMethods import is_video
+
+# Import typing
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from src.backend.DeckManagement.DeckController import DeckController
+    from src.backend.PageManagement.Page import Page
+    from src.backend.PageManagement.PageModel import PageModel
+
+class PageCache:
+    """
+    Process wide LRU cache of the built pages, keyed by (deck controller, page path).
+    The active page of each deck and pages that are still in use (not ready_to_clear) are pinned and never evicted.
+    With weighted eviction pages that show videos count VIDEO_WEIGHT times against the budget because of their decoders and frame caches.
+    """
+    VIDEO_WEIGHT = 4
+
+    def __init__(self, max_weight: int, weighted: bool = False):
+        self.max_weight = max_weight
+        self.weighted = weighted
+
+        self.lock = threading.RLock()
+        # (deck controller, path) -> (page, weight), least recently used first
+        self.entries: OrderedDict[tuple["DeckController", str], tuple["Page", int]] = OrderedDict()
+        self.total_weight: int = 0
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self, deck_controller: "DeckController", path: str) -> "Page":
+        """
+        Returns the cached page and marks it as most recently used
+        """
+        key = (deck_controller, path)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, deck_controller: "DeckController", path: str) -> "Page":
+        """
+        Returns the cached page without marking it as used
+        """
+        with self.lock:
+            entry = self.entries.get((deck_controller, path))
+            if entry is None:
+                return
+            return entry[0]
+
+    def put(self, deck_controller: "DeckController", path: str, page: "Page", used: bool = True) -> None:
+        """
+        Args:
+            used (bool): Whether the page was just used. Pages that weren't (e.g. preloaded ones) are the first to get evicted
+        """
+        key = (deck_controller, path)
+        weight = self.get_weight(page)
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.total_weight -= old[1]
+            self.entries[key] = (page, weight)
+            self.entries.move_to_end(key, last=used)
+            self.total_weight += weight
+        # A used page is about to be shown, so it must not be evicted right away
+        self.evict(keep=key if used else None)
+
+    def remove(self, deck_controller: "DeckController", path: str) -> "Page":
+        with self.lock:
+            entry = self.entries.pop((deck_controller, path), None)
+            if entry is None:
+                return
+            self.total_weight -= entry[1]
+            return entry[0]
+
+    def remove_path(self, path: str) -> list["Page"]:
+        """
+        Removes the page from the cache of all decks
+        """
+        with self.lock:
+            keys = [key for key in self.entries if key[1] == path]
+            return [self.remove(*key) for key in keys]
+
+    def get_pages_with_path(self, path: str) -> list["Page"]:
+        with self.lock:
+            return [page for (_, page_path), (page, _) in self.entries.items() if page_path == path]
+
+    def get_weight(self, page: "Page") -> int:
+        return self.get_model_weight(page.model)
+
+    def get_model_weight(self, model: "PageModel") -> int:
+        """
+        Returns the weight a page with this json would have, without building the page
+        """
+        if not self.weighted:
+            return 1
+        paths = model.get_media_paths()
+        paths.add(model.dict.get("background", {}).get("path"))
+        if any(is_video(path) for path in paths):
+            return self.VIDEO_WEIGHT
+        return 1
+
+    def is_pinned(self, deck_controller: "DeckController", page: "Page") -> bool:
+        return deck_controller.active_page is page or not page.ready_to_clear
+
+    def has_free_weight(self, weight: int = 1) -> bool:
+        with self.lock:
+            return self.total_weight + weight <= self.max_weight
+
+    def set_limits(self, max_weight: int = None, weighted: bool = None) -> None:
+        with self.lock:
+            if max_weight is not None:
+                self.max_weight = max_weight
+            if weighted is not None and weighted != self.weighted:
+                self.weighted = weighted
+                # Recalculate all weights
+                for key, (page, _) in self.entries.items():
+                    self.entries[key] = (page, self.get_weight(page))
+                self.total_weight = sum(weight for _, weight in self.entries.values())
+        self.evict()
+
+    def evict(self, keep: tuple["DeckController", str] = None) -> None:
+        """
+        Evicts the least recently used unpinned pages until the cache fits into its budget
+        """
+        evicted: list["Page"] = []
+        with self.lock:
+            for _ in range(len(self.entries)):
+                if self.total_weight <= self.max_weight:
+                    break
+                key, (page, weight) = next(iter(self.entries.items()))
+                if key == keep or self.is_pinned(key[0], page):
+                    # Pinned pages are in use, so they count as recently used
+                    self.entries.move_to_end(key)
+                    continue
+                del self.entries[key]
+                self.total_weight -= weight
+                self.evictions += 1
+                evicted.append(page)
+
+        for page in evicted:
+            log.trace(f"Evicting page {page.get_name()} from the page cache")
+            page.clear_action_objects()
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit-rate": self.hits / total if total > 0 else 0,
+                "evictions": self.evictions,
+                "pages": len(self.entries),
+                "weight": self.total_weight,
+                "max-weight": self.max_weight,
+            }
@@ -17,6 +17,8 @@ import gc
 import os
 import shutil
 import json
+import threading
+import weakref
 from copy import copy
 from signal import Signals
 import time
@@ -27,6 +29,10 @@ from src.Signals import Signals
 # Import own modules
 from src.backend.PageManagement.Page import Page
 from src.backend.PageManagement.DummyPage import DummyPage
+from src.backend.PageManagement.PageSaveQueue import PageSaveQueue
+from src.backend.PageManagement.PagePreloader import PagePreloader
+from src.backend.PageManagement.PageCache import PageCache
+from src.backend.PageManagement.PageModel import PageModel
 from src.backend.DeckManagement.HelperMethods import natural_sort, natural_sort_by_filenames, recursive_hasattr
 
 # Import globals
@@ -36,17 +42,25 @@ class PageManagerBackend:
     def __init__(self, settings_manager):
         self.settings_manager = settings_manager
 
-        self.created_pages = {}
-        self.created_pages_order = []
+        self.save_queue = PageSaveQueue()
+        gl.signal_manager.connect_signal(signal=Signals.AppQuit, callback=self.save_queue.flush)
+
+        # Pages get built by the preloader as well
+        self.cache_lock = threading.RLock()
+        # abspath -> model shared by the pages of all decks, dropped once no page uses it
+        self.page_models: weakref.WeakValueDictionary[str, PageModel] = weakref.WeakValueDictionary()
+
+        self.preloader = PagePreloader(self)
+        gl.signal_manager.connect_signal(signal=Signals.ChangePage, callback=self.preloader.on_page_change)
+        gl.signal_manager.connect_signal(signal=Signals.AppQuit, callback=self.preloader.close)
 
 
         self.max_pages = 3
 
         settings = gl.settings_manager.get_app_settings()
+        self.page_cache = PageCache(max_weight=self.max_pages, weighted=settings.get("performance", {}).get("weighted-page-cache", False))
         self.set_n_pages_to_cache(int(settings.get("performance", {}).get("n-cached-pages", self.max_pages)))
 
-        self.page_number: int = 0
-
         self.custom_pages = []
 
         self.auto_change_info = {}
@@ -55,11 +69,8 @@ class PageManagerBackend:
         self.dummy_page = DummyPage()
 
     def set_n_pages_to_cache(self, n_pages):
-        old_max_pages = self.max_pages
         self.max_pages = n_pages + 1 # +1 to keep the active page
-
-        if old_max_pages > self.max_pages:
-            self.clear_old_cached_pages()
+        self.page_cache.set_limits(max_weight=self.max_pages)
 
     def save_pages(self) -> None:
         for page in self.pages.values():
@@ -89,59 +100,59 @@ class PageManagerBackend:
             pages.append(os.path.splitext(os.path.basename(page))[0])
         return pages
     
-    def create_page(self, path: str, deck_controller: "DeckController") -> Page:
+    def create_page(self, path: str, deck_controller: "DeckController", used: bool = True) -> Page:
         if path is None:
             return None
         if not os.path.exists(path):
             return None
         page = Page(json_path=path, deck_controller=deck_controller)
-        self.created_pages.setdefault(deck_controller, {})
-        self.created_pages[deck_controller][path] = {
-            "page": page,
-            "page_number": self.page_number
-        }
-        self.page_number += 1
+        self.page_cache.put(deck_controller, path, page, used=used)
 
         return page
     
-    def get_page(self, path: str, deck_controller: "DeckController") -> Page:
-        if deck_controller in self.created_pages:
-            if path in self.created_pages[deck_controller]:
-                self.created_pages[deck_controller][path]["page_number"] = self.page_number
-                self.page_number += 1
-                return self.created_pages[deck_controller][path]["page"]
-        
-        new_page = self.create_page(path, deck_controller)
-        self.clear_old_cached_pages()
-        return new_page
-
-    def clear_old_cached_pages(self):
-        n_pages = 0
-        for controller in self.created_pages:
-            for page in self.created_pages[controller]:
-                n_pages += 1
-
-        for _ in range(n_pages - self.max_pages):
-            if n_pages > self.max_pages:
-                # Remove entry with lowest page number
-                lowest_page = min(self.created_pages[controller][p]["page_number"] for controller in self.created_pages for p in self.created_pages[controller])
-                for controller in self.created_pages:
-                    for page in self.created_pages[controller]:
-                        if controller.active_page is None:
-                            continue
-                        if not self.created_pages[controller][page]["page"].ready_to_clear:
-                            continue
-                        if self.created_pages[controller][page]["page"] is controller.active_page:
-                            continue
-                        if self.created_pages[controller][page]["page_number"] == lowest_page:
-                            page_object: Page = self.created_pages[controller][page]["page"]
-                            page_object.clear_action_objects()
-
-                            self.created_pages[controller][page] = None
-                            del self.created_pages[controller][page]
-                            
-                            break
+    def get_page(self, path: str, deck_controller: "DeckController", used: bool = True) -> Page:
+        """
+        Args:
+            used (bool): False if the page only gets built ahead of time, it then is the first to be evicted
+        """
+        with self.cache_lock:
+            if used:
+                page = self.page_cache.get(deck_controller, path)
+            else:
+                page = self.page_cache.peek(deck_controller, path)
+            if page is not None:
+                return page
+            
+            return self.create_page(path, deck_controller, used=used)
+
+    def get_page_model(self, path: str) -> PageModel:
+        with self.cache_lock:
+            model = self.page_models.get(os.path.abspath(path))
+            if model is None:
+                model = PageModel(json_path=path)
+                self.page_models[os.path.abspath(path)] = model
+            return model
+
+    def get_cached_page(self, path: str, deck_controller: "DeckController") -> Page:
+        """
+        Returns the page if it is cached without building it or marking it as used
+        """
+        return self.page_cache.peek(deck_controller, path)
 
+    def is_page_cached(self, path: str, deck_controller: "DeckController") -> bool:
+        return self.get_cached_page(path, deck_controller) is not None
+
+    def has_free_cache_slot(self, path: str) -> bool:
+        """
+        Returns True if the page fits into the page cache without evicting another page
+        """
+        model = self.get_page_model(path)
+        if not model.loaded:
+            model.reload()
+        return self.page_cache.has_free_weight(self.page_cache.get_model_weight(model))
+
+    def get_page_cache_stats(self) -> dict:
+        return self.page_cache.get_stats()
 
     def get_default_page_for_deck(self, serial_number: str) -> str:
         page_settings = self.settings_manager.load_settings_from_file(os.path.join(gl.DATA_PATH, "settings", "pages.json"))
@@ -178,6 +189,7 @@ class PageManagerBackend:
     
     def move_page(self, old_path: str, new_path: str):
         # Copy page json file
+        self.save_queue.flush_path(old_path)
         shutil.copy2(old_path, new_path)
 
         # Change name in page objects
@@ -198,7 +210,15 @@ class PageManagerBackend:
                     settings["default-pages"][serial_number] = new_path
             gl.settings_manager.save_settings_to_file(os.path.join(gl.DATA_PATH, "settings", "pages.json"), settings)
 
+        # Move the shared model to the new path
+        with self.cache_lock:
+            model = self.page_models.pop(os.path.abspath(old_path), None)
+            if model is not None:
+                model.json_path = new_path
+                self.page_models[os.path.abspath(new_path)] = model
+
         # Remove old page
+        self.save_queue.discard(old_path)
         os.remove(old_path)
 
         # Update ui
@@ -229,6 +249,7 @@ class PageManagerBackend:
 
 
         # Remove page json file
+        self.save_queue.discard(page_path)
         os.remove(page_path)
 
         self.remove_page_path_from_created_pages(page_path)
@@ -246,13 +267,8 @@ class PageManagerBackend:
         self.update_auto_change_info()
 
     def remove_page_path_from_created_pages(self, path: str):
-        for controller in self.created_pages:
-            if path in self.created_pages[controller]:
-                page_object: Page = self.created_pages[controller][path]["page"]
-                page_object.clear_action_objects()
-
-                self.created_pages[controller][path] = None
-                del self.created_pages[controller][path]
+        for page_object in self.page_cache.remove_path(path):
+            page_object.clear_action_objects()
 
 
     def add_page(self, name:str, page_dict: dict = {}):
@@ -293,11 +309,9 @@ class PageManagerBackend:
                 pages.append(controller.active_page)
 
         ## Add from cache
-        for controller in self.created_pages:
-            if page_path in self.created_pages[controller]:
-                page = self.created_pages[controller][page_path]["page"]
-                if page not in pages:
-                    pages.append(page)
+        for page in self.page_cache.get_pages_with_path(page_path):
+            if page not in pages:
+                pages.append(page)
 
         return pages
     
@@ -305,14 +319,16 @@ class PageManagerBackend:
         pages = self.get_pages_with_path(page_path)
 
         for page in pages:
-            page.load()
+            changed_keys = page.load()
             if page.deck_controller.active_page == page:
-                page.deck_controller.load_page(page, allow_reload=True)
+                # Only the keys that changed get loaded again
+                page.deck_controller.load_page(page, allow_reload=True, changed_keys=changed_keys)
 
     def update_dict_of_pages_with_path(self, page_path: str) -> None:
-        pages = self.get_pages_with_path(page_path)
-        for page in pages:
-            page.update_dict()
+        model = self.page_models.get(os.path.abspath(page_path))
+        if model is not None:
+            # Shared by all pages with the path
+            model.reload()
 
     def update_auto_change_info(self):
         start = time.time()
@@ -330,12 +346,11 @@ class PageManagerBackend:
     def set_auto_change_info_for_page(self, page_path: str, info: dict) -> None:
         abs_path = os.path.abspath(page_path)
         self.auto_change_info[abs_path] = info
-        page = self.get_page_json(abs_path)
-
-        page["auto-change"] = info
-
-        with open(abs_path, "w") as f:
-            json.dump(page, f, indent=4)
+        # Hold the lock of the save queue, so that no pending save gets written in between
+        with self.save_queue.lock:
+            page = self.get_page_json(abs_path)
+            page["auto-change"] = info
+            self.save_queue.write_json(abs_path, page)
 
         self.update_dict_of_pages_with_path(abs_path)
 
@@ -350,6 +365,9 @@ class PageManagerBackend:
         """
         if not os.path.exists(page_path):
             return
+
+        # Pending saves are newer than the file
+        self.save_queue.flush_path(page_path)
         
         try:
             with open(page_path, "r") as f:
@@ -376,21 +394,24 @@ class PageManagerBackend:
         
         for page_path in self.get_pages():
             page_had_asset = False
-            with open(page_path, "r") as f:
-                page_dict = json.load(f)
-                for key in page_dict.get("keys", {}):
-                    for state in page_dict["keys"][key].get("states", {}):
-                        dict_path = page_dict["keys"][key]["states"][state].get("media", {}).get("path")
-                        if dict_path is None:
-                            continue
-                        if os.path.abspath(dict_path) == os.path.abspath(path):
-                            page_had_asset = True
-                            page_dict["keys"][key]["states"][state]["media"]["path"] = None
+            # Hold the lock of the save queue, so that no pending save gets written in between
+            with self.save_queue.lock:
+                self.save_queue.flush_path(page_path)
+                with open(page_path, "r") as f:
+                    page_dict = json.load(f)
+                    for key in page_dict.get("keys", {}):
+                        for state in page_dict["keys"][key].get("states", {}):
+                            dict_path = page_dict["keys"][key]["states"][state].get("media", {}).get("path")
+                            if dict_path is None:
+                                continue
+                            if os.path.abspath(dict_path) == os.path.abspath(path):
+                                page_had_asset = True
+                                page_dict["keys"][key]["states"][state]["media"]["path"] = None
+
+                if page_had_asset:
+                    self.save_queue.write_json(page_path, page_dict)
 
             if page_had_asset:
-                with open(page_path, "w") as f:
-                    json.dump(page_dict, f, indent=4)
-
                 self.update_dict_of_pages_with_path(page_path)
 
                 pages = self.get_pages_with_path(page_path)
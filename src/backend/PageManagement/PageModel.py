@@ -0,0 +1,42 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+# Import globals
+import globals as gl
+
+class PageModel:
+    """
+    The parsed json of a page. It is shared by the Page objects of all decks that show the page, these only hold
+    their own action objects.
+    """
+    def __init__(self, json_path: str):
+        self.json_path = json_path
+        self.dict: dict = {}
+        self.loaded = False
+
+    def reload(self) -> None:
+        self.dict = gl.page_manager.get_page_json(self.json_path)
+        self.loaded = True
+
+    def get_media_paths(self) -> set[str]:
+        """
+        Returns the paths of the media of all keys
+        """
+        paths: set[str] = set()
+        for key in self.dict.get("keys", {}).values():
+            for state in key.get("states", {}).values():
+                path = state.get("media", {}).get("path")
+                if path not in ["", None]:
+                    paths.add(path)
+        return paths
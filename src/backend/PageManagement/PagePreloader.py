@@ -0,0 +1,112 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from loguru import logger as log
+
+from src.backend.DeckManagement.Subclasses.font_registry import font_registry
+from src.backend.DeckManagement.Subclasses.media_image_cache import media_image_cache
+from src.backend.DeckManagement.HelperMethods import is_image, is_svg
+
+# Import globals
+import globals as gl
+
+# Import typing
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from src.backend.DeckManagement.DeckController import DeckController
+    from src.backend.PageManagement.Page import Page
+    from src.backend.PageManagement.PageManagerBackend import PageManagerBackend
+
+class PagePreloader:
+    """
+    Builds the pages that can be reached from the active page of a deck in the background.
+    Candidates are the pages referenced by the actions of the active page (e.g. "change page" actions) and the pages
+    that can be auto-changed to on the deck. Pages are only built into free slots of the page cache, so preloading never
+    evicts a page. The media of the candidates gets scaled to the key size and their fonts get loaded as well, so switching
+    to them doesn't touch the disk.
+    """
+    def __init__(self, page_manager: "PageManagerBackend"):
+        self.page_manager = page_manager
+        # A single worker, preloading must not compete with the active page for the cpu
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page_preloader")
+
+    def is_enabled(self) -> bool:
+        return gl.settings_manager.get_app_settings().get("performance", {}).get("preload-pages", True)
+
+    def on_page_change(self, deck_controller: "DeckController", old_path: str, new_path: str) -> None:
+        if not self.is_enabled():
+            return
+        self.executor.submit(self.preload_for_page, deck_controller, new_path)
+
+    def get_candidates(self, deck_controller: "DeckController", page: "Page") -> list[str]:
+        page_paths = self.page_manager.get_pages()
+        candidates = page.get_linked_page_paths(page_paths)
+
+        serial_number = deck_controller.serial_number()
+        for path in page_paths:
+            info = self.page_manager.auto_change_info.get(os.path.abspath(path), {})
+            if not info.get("enable", False):
+                continue
+            if serial_number not in info.get("decks", []):
+                continue
+            if path not in candidates:
+                candidates.append(path)
+
+        return [path for path in candidates if os.path.abspath(path) != os.path.abspath(page.json_path)]
+
+    @log.catch
+    def preload_for_page(self, deck_controller: "DeckController", page_path: str) -> None:
+        page = deck_controller.active_page
+        if page is None or page.json_path != page_path:
+            # The deck switched again in the meantime
+            return
+
+        start = time.time()
+        n_built = 0
+        for path in self.get_candidates(deck_controller, page):
+            if not deck_controller.get_alive() or deck_controller.active_page is not page:
+                return
+
+            if not self.page_manager.is_page_cached(path, deck_controller):
+                # Hold the parsed json, so that building the page doesn't read it again
+                model = self.page_manager.get_page_model(path)
+                if not self.page_manager.has_free_cache_slot(path):
+                    # Other candidates might be lighter, e.g. pages without videos
+                    continue
+                if self.page_manager.get_page(path, deck_controller, used=False) is None:
+                    continue
+                n_built += 1
+
+            self.warm_up(self.page_manager.get_cached_page(path, deck_controller))
+
+        if n_built > 0:
+            log.debug(f"Preloaded {n_built} page(s) reachable from {page.get_name()} in {time.time() - start:.2f} seconds")
+
+    def warm_up(self, page: "Page") -> None:
+        """
+        Scales the media images to the key size and loads the fonts of the page
+        """
+        if page is None:
+            return
+        key_size = page.deck_controller.get_key_image_size()
+        for path, fill_mode, size in page.get_media_layouts():
+            if is_image(path) or is_svg(path):
+                media_image_cache.get_scaled(path, fill_mode, (int(key_size[0] * size), int(key_size[1] * size)))
+        font_registry.warm_up(page.get_label_fonts())
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,143 @@
+"""
+Author: Core447
+Year: 2024
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+any later version.
+
+This programm comes with ABSOLUTELY NO WARRANTY!
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+import atexit
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from loguru import logger as log
+
+# Import globals
+import globals as gl
+
+# Import typing
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from src.backend.PageManagement.Page import Page
+
+class PageSaveQueue:
+    """
+    Write-behind queue for page files.
+    All saves of a page within SAVE_DELAY result in one write of its latest state. The state is copied when the save
+    gets scheduled, so the timer never reads the page while it is being edited. Pages are written to a
+    temporary file that replaces the page, so a page file is never half written. The backup is only
+    refreshed once per BACKUP_INTERVAL.
+    """
+    SAVE_DELAY = 1
+    BACKUP_INTERVAL = 10 * 60
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        # path -> (page dict without action objects, timer)
+        self.pending: dict[str, tuple[dict, threading.Timer]] = {}
+        # path -> time of the last backup
+        self.last_backups: dict[str, float] = {}
+
+        atexit.register(self.flush)
+
+    def schedule(self, page: "Page") -> None:
+        path = os.path.abspath(page.json_path)
+        # Copy the page on the thread that changed it
+        without_objects = page.get_without_action_objects()
+        # Make keys last element
+        page.move_key_to_end(without_objects, "keys")
+
+        with self.lock:
+            pending = self.pending.get(path)
+            if pending is not None:
+                # Coalesce - only the latest state gets written
+                pending[1].cancel()
+
+            timer = threading.Timer(self.SAVE_DELAY, self.flush_path, args=(path,))
+            timer.name = "save_page"
+            timer.daemon = True
+            self.pending[path] = (without_objects, timer)
+            timer.start()
+
+    def is_pending(self, path: str) -> bool:
+        return os.path.abspath(path) in self.pending
+
+    @log.catch
+    def flush_path(self, path: str) -> None:
+        """
+        Writes the pending save of the page right away. Has to be called before reading the page file.
+        """
+        path = os.path.abspath(path)
+        with self.lock:
+            pending = self.pending.pop(path, None)
+            if pending is None:
+                return
+            without_objects, timer = pending
+            timer.cancel()
+
+            self.backup(path)
+            self.write_json(path, without_objects)
+
+    def flush(self) -> None:
+        """
+        Writes all pending saves
+        """
+        with self.lock:
+            paths = list(self.pending.keys())
+        for path in paths:
+            self.flush_path(path)
+
+    def discard(self, path: str) -> None:
+        """
+        Drops the pending save of the page, e.g. because the page got removed
+        """
+        with self.lock:
+            pending = self.pending.pop(os.path.abspath(path), None)
+            if pending is not None:
+                pending[1].cancel()
+
+    def backup(self, path: str) -> None:
+        if time.time() - self.last_backups.get(path, 0) < self.BACKUP_INTERVAL:
+            return
+        if not os.path.exists(path):
+            return
+
+        # Check if json in src is valid
+        with open(path) as f:
+            try:
+                json.load(f)
+            except json.decoder.JSONDecodeError as e:
+                log.error(f"Invalid json in {path}: {e}")
+                return
+
+        os.makedirs(os.path.join(gl.DATA_PATH, "pages", "backups"), exist_ok=True)
+        shutil.copy2(path, os.path.join(gl.DATA_PATH, "pages", "backups", os.path.basename(path)))
+        self.last_backups[path] = time.time()
+
+    def write_json(self, path: str, page_dict: dict) -> None:
+        """
+        Writes the page to a temporary file first, so that the page is never left half written.
+        All writers of page files have to use this method, writes are serialized by the lock.
+        """
+        with self.lock:
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(page_dict, f, indent=4)
+                if os.path.exists(path):
+                    # mkstemp creates the file readable by the owner only
+                    shutil.copymode(path, tmp_path)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
@@ -164,14 +164,16 @@ class ActionBase(rpyc.Service):
         if self.get_key_state().state != self.state:
             return
         
-        if is_image(media_path) and image is None:
-            with Image.open(media_path) as img:
-                image = img.copy()
-
         if is_svg(media_path) and image is None:
             image = gl.media_manager.generate_svg_thumbnail(media_path)
 
-        if image is not None or media_path is None:
+        if is_image(media_path) and image is None:
+            # Key sized versions of the image are cached, so it doesn't have to be decoded every time
+            self.get_key_state().set_key_image(KeyImage(
+                controller_key=self.deck_controller.keys[self.key_index],
+                path=media_path,
+            ), update=False)
+        elif image is not None or media_path is None:
             self.get_key_state().set_key_image(KeyImage(
                 controller_key=self.deck_controller.keys[self.key_index],
                 image=image,
@@ -13,14 +13,51 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 # Import Python modules
+import atexit
 import os, json
+import threading
+from copy import deepcopy
 from loguru import logger as log
 
+from gi.repository import Gio
+
 # Import own modules
 import globals as gl
 
 class SettingsManager:
+    """
+    Settings files are parsed once and then served from memory.
+    External edits are picked up through a file monitor, saves update the memory right away and get written
+    to disk shortly after - multiple saves of the same file within the delay only cause one write.
+    """
+    SAVE_DELAY = 0.5
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.cache: dict[str, dict] = {}
+        self.monitors: dict[str, Gio.FileMonitor] = {}
+
+        # path -> timer of the pending write
+        self.pending_writes: dict[str, threading.Timer] = {}
+
+        atexit.register(self.flush)
+
     def load_settings_from_file(self, file_path: str) -> dict:
+        file_path = os.path.abspath(file_path)
+        with self.lock:
+            if file_path in self.cache:
+                # Callers modify the returned dict before saving it, so they all need their own copy
+                return deepcopy(self.cache[file_path])
+
+        settings = self.read_settings_file(file_path)
+
+        with self.lock:
+            if file_path not in self.pending_writes:
+                self.cache[file_path] = settings
+                self.monitor_file(file_path)
+            return deepcopy(self.cache.get(file_path, settings))
+
+    def read_settings_file(self, file_path: str) -> dict:
         if not os.path.exists(file_path):
             log.warning(f"Settings file {file_path} not found.")
             return {}
@@ -31,14 +68,73 @@ class SettingsManager:
             log.error(f"Invalid json in {file_path}: {e}")
             return {}
         
-        
     def save_settings_to_file(self, file_path: str, settings: dict) -> None:
-        # Create directories if they don't exist
-        if not os.path.exists(os.path.dirname(file_path)) and os.path.dirname(file_path) != "":
-            os.makedirs(os.path.dirname(file_path))
+        file_path = os.path.abspath(file_path)
+        with self.lock:
+            self.cache[file_path] = deepcopy(settings)
+            self.monitor_file(file_path)
+
+            # Restart the delay, the write always uses the latest settings
+            timer = self.pending_writes.get(file_path)
+            if timer is not None:
+                timer.cancel()
+            timer = threading.Timer(self.SAVE_DELAY, self.write_settings_file, args=(file_path,))
+            timer.name = "save_settings"
+            timer.daemon = True
+            self.pending_writes[file_path] = timer
+            timer.start()
+
+    @log.catch
+    def write_settings_file(self, file_path: str) -> None:
+        with self.lock:
+            self.pending_writes.pop(file_path, None)
+            settings = self.cache.get(file_path)
+            if settings is None:
+                return
+            data = json.dumps(settings, indent=4)
+
+            # Create directories if they don't exist
+            if not os.path.exists(os.path.dirname(file_path)) and os.path.dirname(file_path) != "":
+                os.makedirs(os.path.dirname(file_path))
+
+            # Write to a temporary file first, so that the file is never left half written
+            tmp_path = f"{file_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)
+
+    def flush(self) -> None:
+        """
+        Writes all pending saves right away
+        """
+        with self.lock:
+            pending = list(self.pending_writes.items())
+        for file_path, timer in pending:
+            timer.cancel()
+            self.write_settings_file(file_path)
+
+    def monitor_file(self, file_path: str) -> None:
+        if file_path in self.monitors:
+            return
+        try:
+            monitor = Gio.File.new_for_path(file_path).monitor_file(Gio.FileMonitorFlags.NONE, None)
+        except Exception as e:
+            log.warning(f"Failed to monitor {file_path}, external changes won't be noticed: {e}")
+            self.monitors[file_path] = None
+            return
+        monitor.connect("changed", self.on_file_changed, file_path)
+        self.monitors[file_path] = monitor
 
-        with open(file_path, "w") as f:
-            json.dump(settings, f, indent=4)
+    def on_file_changed(self, monitor: Gio.FileMonitor, file: Gio.File, other_file: Gio.File, event_type: Gio.FileMonitorEvent, file_path: str) -> None:
+        if event_type not in (Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.CREATED,
+                              Gio.FileMonitorEvent.DELETED, Gio.FileMonitorEvent.MOVED_IN, Gio.FileMonitorEvent.RENAMED):
+            return
+        with self.lock:
+            if file_path in self.pending_writes:
+                # The cached settings are newer than the file
+                return
+            # Load the file again the next time it is used
+            self.cache.pop(file_path, None)
 
     def get_deck_settings(self, deck_serial_number: str) -> dict:
         """
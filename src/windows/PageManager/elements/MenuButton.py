@@ -114,9 +114,7 @@ class MenuButton(Gtk.MenuButton):
         ChooseExportFileDialog(self, self.export_page_callback, initial_name=initial_name)
 
     def export_page_callback(self, selected_file):
-        page_json = {}
-        with open(self.pageEditor.active_page_path, "r") as f:
-            page_json = json.load(f)
+        page_json = gl.page_manager.get_page_json(self.pageEditor.active_page_path)
 
         with open(selected_file.get_path(), "w") as f:
             json.dump(page_json, f, indent=4)
@@ -151,6 +149,8 @@ class MenuButton(Gtk.MenuButton):
             return
         
         import_dict = {}
+        # Duplicated pages can have pending saves that are newer than the file
+        gl.page_manager.save_queue.flush_path(self.selected_file.get_path())
         with open(self.selected_file.get_path(), "r") as f:
             import_dict = json.load(f)
 
@@ -24,6 +24,7 @@ from gi.repository import Gtk, Adw, Gio
 
 # Import globals
 import globals as gl
+from src.backend.DeckManagement.Subclasses.video_cache_budget import video_cache_budget
 
 import os
 
@@ -353,16 +354,51 @@ class PerformancePageGroup(Adw.PreferencesGroup):
                                           tooltip_text=gl.lm.get("settings.performance.cache-videos.tooltip"))
         self.add(self.cache_videos)
 
+        self.cache_native_video_frames = Adw.SwitchRow(title=gl.lm.get("settings.performance.cache-native-video-frames.title"), active=True,
+                                                       subtitle=gl.lm.get("settings.performance.cache-native-video-frames.subtitle"),
+                                                       tooltip_text=gl.lm.get("settings.performance.cache-native-video-frames.tooltip"))
+        self.add(self.cache_native_video_frames)
+
+        self.video_cache_mb = Adw.SpinRow.new_with_range(min=64, max=65536, step=64)
+        self.video_cache_mb.set_title(gl.lm.get("settings.performance.video-cache-mb.title"))
+        self.video_cache_mb.set_subtitle(gl.lm.get("settings.performance.video-cache-mb.subtitle"))
+        self.video_cache_mb.set_tooltip_text(gl.lm.get("settings.performance.video-cache-mb.tooltip"))
+        self.add(self.video_cache_mb)
+
+        self.video_cache_per_deck_mb = Adw.SpinRow.new_with_range(min=64, max=65536, step=64)
+        self.video_cache_per_deck_mb.set_title(gl.lm.get("settings.performance.video-cache-per-deck-mb.title"))
+        self.video_cache_per_deck_mb.set_subtitle(gl.lm.get("settings.performance.video-cache-per-deck-mb.subtitle"))
+        self.video_cache_per_deck_mb.set_tooltip_text(gl.lm.get("settings.performance.video-cache-per-deck-mb.tooltip"))
+        self.add(self.video_cache_per_deck_mb)
+
+        self.video_cache_usage = Adw.ActionRow(title=gl.lm.get("settings.performance.video-cache-usage.title"))
+        self.add(self.video_cache_usage)
+
         self.load_defaults()
 
         # Connect signals
         self.n_cached_pages.connect("changed", self.on_n_cached_pages_changed)
         self.cache_videos.connect("notify::active", self.on_cache_videos_toggled)
+        self.cache_native_video_frames.connect("notify::active", self.on_cache_native_video_frames_toggled)
+        self.video_cache_mb.connect("changed", self.on_video_cache_mb_changed)
+        self.video_cache_per_deck_mb.connect("changed", self.on_video_cache_per_deck_mb_changed)
+        self.connect("map", self.on_map)
 
     def load_defaults(self):
         settings = self.settings.settings_json
         self.n_cached_pages.set_value(settings.get("performance", {}).get("n-cached-pages", 3))
         self.cache_videos.set_active(settings.get("performance", {}).get("cache-videos", True))
+        self.cache_native_video_frames.set_active(settings.get("performance", {}).get("cache-native-video-frames", True))
+        self.video_cache_mb.set_value(settings.get("performance", {}).get("video-cache-mb", 1024))
+        self.video_cache_per_deck_mb.set_value(settings.get("performance", {}).get("video-cache-per-deck-mb", 512))
+        self.update_video_cache_usage()
+
+    def on_map(self, *args):
+        self.update_video_cache_usage()
+
+    def update_video_cache_usage(self):
+        usage_mb = video_cache_budget.get_usage() / 1024 / 1024
+        self.video_cache_usage.set_subtitle(f"{usage_mb:.0f} MB / {self.video_cache_mb.get_value():.0f} MB")
 
     def on_n_cached_pages_changed(self, *args):
         self.settings.settings_json.setdefault("performance", {})
@@ -381,6 +417,34 @@ class PerformancePageGroup(Adw.PreferencesGroup):
         # Save
         self.settings.save_json()
 
+    def on_cache_native_video_frames_toggled(self, *args):
+        self.settings.settings_json.setdefault("performance", {})
+        self.settings.settings_json["performance"]["cache-native-video-frames"] = self.cache_native_video_frames.get_active()
+
+        # Save
+        self.settings.save_json()
+
+    def on_video_cache_mb_changed(self, *args):
+        self.settings.settings_json.setdefault("performance", {})
+        self.settings.settings_json["performance"]["video-cache-mb"] = int(self.video_cache_mb.get_value())
+
+        # Save
+        self.settings.save_json()
+
+        # Update the budget for new videos
+        video_cache_budget.set_limits(global_mb=int(self.video_cache_mb.get_value()))
+        self.update_video_cache_usage()
+
+    def on_video_cache_per_deck_mb_changed(self, *args):
+        self.settings.settings_json.setdefault("performance", {})
+        self.settings.settings_json["performance"]["video-cache-per-deck-mb"] = int(self.video_cache_per_deck_mb.get_value())
+
+        # Save
+        self.settings.save_json()
+
+        # Update the budget for new videos
+        video_cache_budget.set_limits(per_deck_mb=int(self.video_cache_per_deck_mb.get_value()))
+
 
 class SystemPage(Adw.PreferencesPage):
     def __init__(self, settings: Settings):